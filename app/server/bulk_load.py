@@ -0,0 +1,171 @@
+"""
+Массовая загрузка пользователей, подписок, твитов и лайков через COPY.
+
+Файлы в формате CSV (первая строка — названия колонок) или NDJSON
+(один JSON-объект на строку), формат определяется по расширению.
+На время загрузки вторичные индексы загружаемых таблиц удаляются
+и затем строятся заново; всё выполняется в одной транзакции. После
+загрузки сдвигаются последовательности id, пересчитываются счётчики
+и заполняются ленты.
+
+Пример:
+    python bulk_load.py --users users.csv --follows follows.ndjson --tweets tweets.csv --likes likes.csv
+"""
+import argparse
+import asyncio
+import json
+import os
+import time
+
+from counters import repair_counters
+from database import engine
+from migrations import migrate
+from sqlalchemy import text
+from timeline import rebuild_timelines
+
+TABLES = (
+    ('users', 'users', ('id', 'name', 'api_key')),
+    ('tweets', 'tweets', ('id', 'user_id', 'content_data', 'attachments')),
+    ('follows', 'followers', ('follower_id', 'followed_id')),
+    ('likes', 'likes', ('user_id', 'tweet_id')),
+)
+SERIAL_TABLES = ('users', 'tweets')
+
+
+def file_format(path: str) -> str:
+    """Формат файла по расширению"""
+    extension = os.path.splitext(path)[1].lower()
+    if extension == '.csv':
+        return 'csv'
+    if extension in {'.ndjson', '.jsonl'}:
+        return 'ndjson'
+    raise ValueError('Unsupported file format: {0}'.format(path))
+
+
+def csv_columns(path: str, allowed: tuple) -> list:
+    """Колонки из заголовка CSV"""
+    with open(path, newline='') as source:
+        columns = [column.strip() for column in source.readline().strip().split(',')]
+    unknown = set(columns) - set(allowed)
+    if unknown:
+        raise ValueError('Unknown columns in {0}: {1}'.format(path, ', '.join(sorted(unknown))))
+    return columns
+
+
+def ndjson_records(path: str, allowed: tuple):
+    """
+    Колонки по первому объекту файла и генератор кортежей значений.
+
+    Returns:
+        tuple: Список колонок и итератор записей
+    """
+    with open(path) as source:
+        first = json.loads(source.readline())
+    columns = [column for column in allowed if column in first]
+
+    def records():
+        with open(path) as lines:
+            for line in lines:
+                if line.strip():
+                    row = json.loads(line)
+                    yield tuple(row.get(column) for column in columns)
+    return columns, records()
+
+
+async def secondary_indexes(conn, tables) -> list:
+    """Определения индексов таблиц, не обеспечивающих первичные ключи и ограничения"""
+    indexes = await conn.execute(text(
+        'SELECT index_class.relname, pg_get_indexdef(pg_index.indexrelid) FROM pg_index '
+        'JOIN pg_class index_class ON index_class.oid = pg_index.indexrelid '
+        'JOIN pg_class table_class ON table_class.oid = pg_index.indrelid '
+        'WHERE table_class.relname = ANY(:tables) '
+        'AND NOT EXISTS (SELECT 1 FROM pg_constraint WHERE pg_constraint.conindid = pg_index.indexrelid)',
+    ), {'tables': list(tables)})
+    return indexes.all()
+
+
+async def copy_file(driver, table: str, path: str, allowed: tuple) -> int:
+    """Загрузить файл в таблицу через COPY и вернуть число строк"""
+    if file_format(path) == 'csv':
+        status = await driver.copy_to_table(
+            table, source=path, columns=csv_columns(path, allowed), format='csv', header=True,
+        )
+    else:
+        columns, records = ndjson_records(path, allowed)
+        status = await driver.copy_records_to_table(table, records=records, columns=columns)
+    return int(status.split()[-1])
+
+
+async def bulk_load(sources: dict, rebuild_indexes: bool = True, target_engine=engine) -> dict:
+    """
+    Загрузить файлы в таблицы одной транзакцией.
+
+    Parameters:
+        sources (dict): Пути к файлам по ключам users, follows, tweets, likes
+        rebuild_indexes (bool): Удалить вторичные индексы на время загрузки
+        target_engine: Движок базы данных, по умолчанию основной
+
+    Returns:
+        dict: Число строк и время загрузки по таблицам, время перестроения индексов и обслуживания
+    """
+    report = {'tables': {}}
+    targets = [(table, path, columns) for name, table, columns in TABLES if (path := sources.get(name))]
+    async with target_engine.begin() as conn:
+        indexes = await secondary_indexes(conn, [table for table, _, _ in targets])
+        if not rebuild_indexes:
+            indexes = []
+        for name, _ in indexes:
+            await conn.execute(text('DROP INDEX {0}'.format(name)))
+        driver = (await conn.get_raw_connection()).driver_connection
+        for table, path, columns in targets:
+            started = time.perf_counter()
+            rows = await copy_file(driver, table, path, columns)
+            report['tables'][table] = {'rows': rows, 'seconds': time.perf_counter() - started}
+
+        started = time.perf_counter()
+        for _, definition in indexes:
+            await conn.execute(text(definition))
+        report['indexes_seconds'] = time.perf_counter() - started
+
+        started = time.perf_counter()
+        for table in SERIAL_TABLES:
+            await conn.execute(text(
+                "SELECT setval(pg_get_serial_sequence('{0}', 'id'), COALESCE(max(id), 0) + 1, false) FROM {0}".format(table),
+            ))
+        await repair_counters(conn)
+        await rebuild_timelines(conn)
+        report['maintenance_seconds'] = time.perf_counter() - started
+    async with target_engine.connect() as conn:
+        conn = await conn.execution_options(isolation_level='AUTOCOMMIT')
+        await conn.execute(text('ANALYZE'))
+    return report
+
+
+async def main(args: argparse.Namespace) -> None:
+    """Загрузка файлов и вывод скорости по таблицам"""
+    await migrate()
+    started = time.perf_counter()
+    report = await bulk_load(
+        {'users': args.users, 'follows': args.follows, 'tweets': args.tweets, 'likes': args.likes},
+        rebuild_indexes=not args.keep_indexes,
+    )
+    elapsed = time.perf_counter() - started
+    for table, result in report['tables'].items():
+        print('{0:<12} {1:>10} rows {2:>8.2f}s {3:>12.0f} rows/s'.format(
+            table, result['rows'], result['seconds'], result['rows'] / max(result['seconds'], 1e-9),
+        ))
+    print('indexes rebuilt in {0:.2f}s, counters and timelines in {1:.2f}s'.format(
+        report['indexes_seconds'], report['maintenance_seconds'],
+    ))
+    loaded = sum(result['rows'] for result in report['tables'].values())
+    print('{0:<12} {1:>10} rows {2:>8.2f}s {3:>12.0f} rows/s'.format('total', loaded, elapsed, loaded / elapsed))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', help='CSV/NDJSON с колонками id, name, api_key')
+    parser.add_argument('--follows', help='CSV/NDJSON с колонками follower_id, followed_id')
+    parser.add_argument('--tweets', help='CSV/NDJSON с колонками id, user_id, content_data, attachments')
+    parser.add_argument('--likes', help='CSV/NDJSON с колонками user_id, tweet_id')
+    parser.add_argument('--keep-indexes', action='store_true', help='не перестраивать индексы на время загрузки')
+    asyncio.run(main(parser.parse_args()))
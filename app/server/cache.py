@@ -0,0 +1,304 @@
+import os
+import secrets
+import time
+from collections import OrderedDict
+from typing import NamedTuple
+
+MISSING = object()
+
+
+class CachedUser(NamedTuple):
+    """Данные пользователя, достаточные для авторизации запроса"""
+
+    id: int
+    name: str
+    api_key: str
+
+
+class TTLCache:
+    """Кэш ограниченного размера с временем жизни записей и вытеснением LRU"""
+
+    def __init__(self, maxsize: int, ttl: float) -> None:
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._data: OrderedDict = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def get(self, key):
+        """Значение по ключу или MISSING, если его нет или оно устарело"""
+        item = self._data.get(key)
+        if item is None or item[0] < time.monotonic():
+            if item is not None:
+                del self._data[key]
+            self.misses += 1
+            return MISSING
+        self._data.move_to_end(key)
+        self.hits += 1
+        return item[1]
+
+    def set(self, key, value) -> None:
+        """Сохранить значение, вытеснив самую давнюю запись при переполнении"""
+        self._data[key] = (time.monotonic() + self.ttl, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def invalidate(self, key) -> None:
+        """Удалить запись по ключу"""
+        self._data.pop(key, None)
+
+    def invalidate_where(self, predicate) -> None:
+        """Удалить записи, для которых predicate(key, value) истинно"""
+        for key in [key for key, item in self._data.items() if predicate(key, item[1])]:
+            del self._data[key]
+
+    def clear(self) -> None:
+        """Очистить кэш"""
+        self._data.clear()
+
+
+auth_cache = TTLCache(
+    maxsize=int(os.getenv('AUTH_CACHE_SIZE', '10000')),
+    ttl=float(os.getenv('AUTH_CACHE_TTL', '300')),
+)
+# Неизвестные ключи хранятся отдельно, чтобы поток неверных ключей
+# не вытеснял из кэша действующих пользователей.
+auth_negative_cache = TTLCache(
+    maxsize=int(os.getenv('AUTH_NEGATIVE_CACHE_SIZE', '10000')),
+    ttl=float(os.getenv('AUTH_NEGATIVE_CACHE_TTL', '30')),
+)
+
+
+# Профили без пагинации: короткое время жизни сглаживает частые повторные запросы
+profile_cache = TTLCache(
+    maxsize=int(os.getenv('PROFILE_CACHE_SIZE', '10000')),
+    ttl=float(os.getenv('PROFILE_CACHE_TTL', '5')),
+)
+
+
+# Ключи API пользователей, недавно изменявших данные: их чтение идёт
+# на основной сервер, а не на реплику.
+recent_writers = TTLCache(
+    maxsize=int(os.getenv('READ_STICKY_CACHE_SIZE', '100000')),
+    ttl=float(os.getenv('DB_READ_STICKY_SECONDS', '5')),
+)
+
+
+# Начальная версия ресурсов при общей шине инвалидации: одинакова во всех процессах
+INITIAL_VERSION = '0' * 24
+
+
+def new_version() -> str:
+    """
+    Новая версия: отметка времени в наносекундах и случайный суффикс.
+
+    Версии одного ресурса из разных процессов упорядочены по времени,
+    поэтому процессы сходятся к самой новой из них.
+    """
+    return '{0:016x}{1}'.format(time.time_ns(), secrets.token_hex(4))
+
+
+class VersionCache(TTLCache):
+    """
+    Версии ресурсов для ETag.
+
+    Ресурс без записи получает версию floor. Она не старше вытесненных
+    версий, поэтому ETag, выданный до изменения ресурса, не совпадёт
+    с текущим и после вытеснения записи.
+    """
+
+    def __init__(self, maxsize: int, floor: str) -> None:
+        super().__init__(maxsize, float('inf'))
+        self.floor = floor
+
+    def version(self, key) -> str:
+        """Версия ресурса: из записи или floor"""
+        version = self.get(key)
+        return self.floor if version is MISSING else version
+
+    def set(self, key, value) -> None:
+        """Сохранить версию; вытесненная версия поднимает floor"""
+        self._data[key] = (self.ttl, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            _, (_, evicted) = self._data.popitem(last=False)
+            self.floor = max(self.floor, evicted)
+
+    def reset(self, versions, floor: str) -> None:
+        """Заменить все версии, например загруженными из общей таблицы"""
+        self._data.clear()
+        self.floor = floor
+        for key, version in sorted(versions, key=lambda item: item[1]):
+            self.set(key, version)
+
+
+# Без шины инвалидации начальная версия своя у каждого запуска процесса:
+# ETag, выданный до перезапуска, не совпадёт с версией изменённого ресурса.
+version_cache = VersionCache(maxsize=int(os.getenv('VERSION_CACHE_SIZE', '100000')), floor=new_version())
+
+
+# Авторы ленты пользователя (он сам и его подписки) для ETag ленты
+following_cache = TTLCache(
+    maxsize=int(os.getenv('FOLLOWING_CACHE_SIZE', '10000')),
+    ttl=float(os.getenv('FOLLOWING_CACHE_TTL', '60')),
+)
+
+# Обработчики, которым сообщается о каждой инвалидации в этом процессе:
+# через них шина invalidation.py рассылает изменения другим процессам.
+invalidation_listeners: list = []
+
+
+def profile_version(user_id: int) -> tuple:
+    """Ключ версии профиля пользователя"""
+    return ('profile', user_id)
+
+
+def timeline_version(user_id: int) -> tuple:
+    """Ключ версии состава ленты пользователя: подписки и его несохранённые лайки"""
+    return ('timeline', user_id)
+
+
+def author_version(user_id: int) -> tuple:
+    """Ключ версии твитов автора: сами твиты, их лайки и популярность"""
+    return ('author', user_id)
+
+
+def feed_versions(user_id: int, author_ids) -> list:
+    """Ключи версий, от которых зависит лента пользователя"""
+    return [timeline_version(user_id), *(author_version(author_id) for author_id in author_ids)]
+
+
+def version_time(version: str) -> float:
+    """Время создания версии, секунды с начала эпохи"""
+    return int(version[:16], 16) / 1e9
+
+
+def get_version(key) -> str:
+    """Текущая версия ресурса"""
+    return version_cache.version(key)
+
+
+def version_name(key) -> str:
+    """Ключ версии в виде строки для общей таблицы cache_versions"""
+    return '{0}:{1}'.format(*key)
+
+
+def parse_version_name(name: str) -> tuple:
+    """Ключ версии по строке из общей таблицы cache_versions"""
+    kind, key_id = name.split(':')
+    return kind, int(key_id)
+
+
+def bump_version(*keys) -> list:
+    """
+    Сменить версии ресурсов после изменения данных.
+
+    Returns:
+        list: Новые версии в порядке ключей
+    """
+    versions = []
+    for key in keys:
+        version = new_version()
+        version_cache.set(key, version)
+        versions.append(version)
+    return versions
+
+
+def merge_version(key, version: str) -> None:
+    """Принять версию из другого процесса, если она новее текущей"""
+    if version > version_cache.version(key):
+        version_cache.set(key, version)
+
+
+def notify_invalidation(kind: str, **data) -> None:
+    """Сообщить обработчикам об инвалидации в этом процессе"""
+    for listener in invalidation_listeners:
+        listener(kind, data)
+
+
+def invalidate_api_key(api_key: str) -> None:
+    """Сбросить кэш авторизации для ключа API"""
+    auth_cache.invalidate(api_key)
+    auth_negative_cache.invalidate(api_key)
+    notify_invalidation('api_key', api_key=api_key)
+
+
+def invalidate_user(user_id: int) -> None:
+    """Сбросить кэш авторизации для всех ключей пользователя"""
+    auth_cache.invalidate_where(lambda _, user: user.id == user_id)
+    notify_invalidation('user', user_id=user_id)
+
+
+def invalidate_profiles(*user_ids: int) -> None:
+    """Сбросить кэшированные профили пользователей и сменить их версии"""
+    for user_id in user_ids:
+        profile_cache.invalidate(user_id)
+    versions = bump_version(*(profile_version(user_id) for user_id in user_ids))
+    notify_invalidation('profiles', user_ids=list(user_ids), versions=versions)
+
+
+def invalidate_feeds(user_ids=(), author_ids=()) -> None:
+    """
+    Сменить версии лент, затронутых изменением.
+
+    Parameters:
+        user_ids: Пользователи, у которых изменились подписки или собственные несохранённые лайки
+        author_ids: Авторы, у которых появились или удалены твиты, изменились лайки твитов
+            или число подписчиков, — это меняет ленты всех их подписчиков
+    """
+    for user_id in user_ids:
+        following_cache.invalidate(user_id)
+    timelines = dict(zip(map(str, user_ids), bump_version(*map(timeline_version, user_ids))))
+    authors = dict(zip(map(str, author_ids), bump_version(*map(author_version, author_ids))))
+    if timelines or authors:
+        notify_invalidation('feeds', timelines=timelines, authors=authors)
+
+
+def mark_writer(api_key: str) -> None:
+    """Закрепить чтение пользователя за основным сервером после записи"""
+    recent_writers.set(api_key, True)
+    notify_invalidation('writer', api_key=api_key)
+
+
+def apply_invalidation(kind: str, data: dict) -> None:
+    """
+    Применить инвалидацию, полученную от другого процесса.
+
+    Обработчики не вызываются, чтобы сообщение не разослалось повторно.
+    """
+    if kind == 'feeds':
+        for user_id, version in data['timelines'].items():
+            following_cache.invalidate(int(user_id))
+            merge_version(timeline_version(int(user_id)), version)
+        for author_id, version in data['authors'].items():
+            merge_version(author_version(int(author_id)), version)
+    elif kind == 'profiles':
+        for user_id, version in zip(data['user_ids'], data['versions']):
+            profile_cache.invalidate(user_id)
+            merge_version(profile_version(user_id), version)
+    elif kind == 'api_key':
+        auth_cache.invalidate(data['api_key'])
+        auth_negative_cache.invalidate(data['api_key'])
+    elif kind == 'user':
+        auth_cache.invalidate_where(lambda _, user: user.id == data['user_id'])
+    elif kind == 'writer':
+        recent_writers.set(data['api_key'], True)
+
+
+def reset_caches(versions=(), floor: str = INITIAL_VERSION) -> None:
+    """
+    Сбросить все кэши процесса.
+
+    Нужно, если сообщения других процессов могли быть пропущены. Версии
+    заменяются общими для всех процессов: versions — пары (ключ, версия),
+    загруженные из таблицы cache_versions, остальные ресурсы получают floor.
+    """
+    auth_cache.clear()
+    auth_negative_cache.clear()
+    profile_cache.clear()
+    following_cache.clear()
+    version_cache.reset(versions, floor)
@@ -0,0 +1,245 @@
+import asyncio
+from collections import Counter
+
+from database import async_session
+from models import Follow, Like, Tweet, User
+from ranking import rescore_tweets
+from sqlalchemy import ARRAY, Integer, any_, bindparam, delete, func, tuple_, update
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.future import select
+from timeline import FANOUT_FOLLOWERS_LIMIT, backfill_author_followers, prune_author_followers
+
+
+def int_array(name, values):
+    """Параметр-массив целых чисел для сравнения через ANY"""
+    return bindparam(name, list(values), type_=ARRAY(Integer))
+
+
+async def add_likes(session, user_id, tweet_ids):
+    """
+    Поставить лайки набору твитов одним запросом и увеличить их счётчики.
+
+    Популярность твитов пересчитывается отдельно (см. rescoring.py).
+
+    Returns:
+        list: Идентификаторы твитов, которым лайк действительно добавлен
+    """
+    if not tweet_ids:
+        return []
+    inserted = await session.execute(
+        insert(Like).values([
+            {'user_id': user_id, 'tweet_id': tweet_id} for tweet_id in tweet_ids
+        ]).on_conflict_do_nothing().returning(Like.tweet_id),
+    )
+    liked = inserted.scalars().all()
+    if liked:
+        await session.execute(
+            update(Tweet).where(
+                Tweet.id == any_(int_array('liked_ids', liked)),
+            ).values(like_count=Tweet.like_count + 1),
+        )
+    return liked
+
+
+async def tweet_authors(session, tweet_ids):
+    """Авторы набора твитов одним запросом"""
+    if not tweet_ids:
+        return []
+    authors = await session.execute(
+        select(Tweet.user_id).where(Tweet.id == any_(int_array('author_tweet_ids', set(tweet_ids)))).distinct(),
+    )
+    return authors.scalars().all()
+
+
+async def add_like(session, user_id, tweet_id):
+    """Поставить лайк и увеличить счётчик лайков твита в той же транзакции"""
+    return bool(await add_likes(session, user_id, [tweet_id]))
+
+
+async def remove_like(session, user_id, tweet_id):
+    """Убрать лайк и уменьшить счётчик лайков твита в той же транзакции"""
+    deleted = await session.execute(
+        delete(Like).where(Like.user_id == user_id, Like.tweet_id == tweet_id).returning(Like.tweet_id),
+    )
+    if deleted.first() is None:
+        return False
+    await session.execute(
+        update(Tweet).where(Tweet.id == tweet_id).values(like_count=Tweet.like_count - 1),
+    )
+    return True
+
+
+async def change_like_counts(session, tweet_ids, sign):
+    """Изменить счётчики лайков на sign за каждое вхождение твита в tweet_ids"""
+    deltas = Counter(tweet_ids)
+    if not deltas:
+        return
+    changes = select(
+        func.unnest(int_array('delta_ids', deltas.keys())).label('tweet_id'),
+        func.unnest(int_array('delta_values', [sign * count for count in deltas.values()])).label('delta'),
+    ).subquery()
+    await session.execute(
+        update(Tweet).where(Tweet.id == changes.c.tweet_id).values(like_count=Tweet.like_count + changes.c.delta),
+    )
+
+
+async def add_like_pairs(session, pairs):
+    """
+    Сохранить лайки разных пользователей одним запросом и обновить счётчики.
+
+    Пары с уже удалёнными твитами пропускаются.
+
+    Returns:
+        list: Пары (пользователь, твит), лайк для которых действительно добавлен
+    """
+    if not pairs:
+        return []
+    user_ids, tweet_ids = zip(*pairs)
+    new_likes = select(
+        func.unnest(int_array('user_ids', user_ids)).label('user_id'),
+        func.unnest(int_array('tweet_ids', tweet_ids)).label('tweet_id'),
+    ).subquery()
+    inserted = await session.execute(
+        insert(Like).from_select(
+            ['user_id', 'tweet_id'],
+            select(new_likes.c.user_id, new_likes.c.tweet_id).join(Tweet, Tweet.id == new_likes.c.tweet_id),
+        ).on_conflict_do_nothing().returning(Like.user_id, Like.tweet_id),
+    )
+    liked = [tuple(row) for row in inserted]
+    await change_like_counts(session, [tweet_id for _, tweet_id in liked], 1)
+    return liked
+
+
+async def remove_like_pairs(session, pairs):
+    """
+    Удалить лайки разных пользователей одним запросом и обновить счётчики.
+
+    Returns:
+        list: Пары (пользователь, твит), лайк для которых действительно удалён
+    """
+    if not pairs:
+        return []
+    deleted = await session.execute(
+        delete(Like).where(
+            tuple_(Like.user_id, Like.tweet_id).in_(list(pairs)),
+        ).returning(Like.user_id, Like.tweet_id),
+    )
+    unliked = [tuple(row) for row in deleted]
+    await change_like_counts(session, [tweet_id for _, tweet_id in unliked], -1)
+    return unliked
+
+
+async def update_fan_out(session, followers_counts, delta):
+    """
+    Перевести авторов, число подписчиков которых пересекло FANOUT_FOLLOWERS_LIMIT,
+    между рассылкой твитов при записи и чтением при выдаче ленты.
+
+    Parameters:
+        followers_counts: Пары (автор, новое число подписчиков)
+        delta: На сколько изменилось число подписчиков
+    """
+    crossed = [
+        author_id for author_id, followers_count in followers_counts
+        if (followers_count > FANOUT_FOLLOWERS_LIMIT) != (followers_count - delta > FANOUT_FOLLOWERS_LIMIT)
+    ]
+    if not crossed:
+        return
+    if delta > 0:
+        await prune_author_followers(session, crossed)
+    else:
+        for author_id in crossed:
+            await backfill_author_followers(session, author_id)
+
+
+async def update_follow_counters(session, follower_id, followed_id, delta):
+    """Изменить счётчики подписок и подписчиков обоих пользователей"""
+    await session.execute(
+        update(User).where(User.id == follower_id).values(following_count=User.following_count + delta),
+    )
+    followers_counts = await session.execute(
+        update(User).where(User.id == followed_id).values(
+            followers_count=User.followers_count + delta,
+        ).returning(User.id, User.followers_count),
+    )
+    await update_fan_out(session, followers_counts.all(), delta)
+
+
+async def add_follows(session, follower_id, followed_ids):
+    """
+    Подписаться на набор пользователей одним запросом и обновить счётчики.
+
+    Returns:
+        list: Идентификаторы пользователей, подписка на которых действительно добавлена
+    """
+    if not followed_ids:
+        return []
+    inserted = await session.execute(
+        insert(Follow).values([
+            {'follower_id': follower_id, 'followed_id': followed_id} for followed_id in followed_ids
+        ]).on_conflict_do_nothing().returning(Follow.followed_id),
+    )
+    followed = inserted.scalars().all()
+    if followed:
+        await session.execute(
+            update(User).where(User.id == follower_id).values(
+                following_count=User.following_count + len(followed),
+            ),
+        )
+        followers_counts = await session.execute(
+            update(User).where(
+                User.id == any_(int_array('followed_ids', followed)),
+            ).values(followers_count=User.followers_count + 1).returning(User.id, User.followers_count),
+        )
+        await update_fan_out(session, followers_counts.all(), 1)
+    return followed
+
+
+async def add_follow(session, follower_id, followed_id):
+    """Подписаться на пользователя и обновить счётчики в той же транзакции"""
+    return bool(await add_follows(session, follower_id, [followed_id]))
+
+
+async def remove_follow(session, follower_id, followed_id):
+    """Отписаться от пользователя и обновить счётчики в той же транзакции"""
+    deleted = await session.execute(
+        delete(Follow).where(
+            Follow.follower_id == follower_id, Follow.followed_id == followed_id,
+        ).returning(Follow.followed_id),
+    )
+    if deleted.first() is None:
+        return False
+    await update_follow_counters(session, follower_id, followed_id, -1)
+    return True
+
+
+async def repair_counters(session):
+    """Пересчитать все счётчики по таблицам likes и followers и популярность твитов"""
+    await session.execute(
+        update(Tweet).values(
+            like_count=select(func.count()).select_from(Like).where(
+                Like.tweet_id == Tweet.id,
+            ).scalar_subquery(),
+        ),
+    )
+    await session.execute(
+        update(User).values(
+            followers_count=select(func.count()).select_from(Follow).where(
+                Follow.followed_id == User.id,
+            ).scalar_subquery(),
+            following_count=select(func.count()).select_from(Follow).where(
+                Follow.follower_id == User.id,
+            ).scalar_subquery(),
+        ),
+    )
+    await rescore_tweets(session)
+
+
+async def main() -> None:
+    """Пересчёт денормализованных счётчиков"""
+    async with async_session() as session:
+        await repair_counters(session)
+        await session.commit()
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -1,10 +1,24 @@
+"""server."""
+import asyncio
+import contextlib
+import logging
 import os
+import time
+from contextvars import ContextVar
+from typing import AsyncGenerator, Optional
+
+from cache import MISSING, get_version, mark_writer, recent_writers, version_time
 from dotenv import load_dotenv
+from fastapi import Request
+from sqlalchemy import event, text
+from sqlalchemy.exc import InterfaceError, OperationalError
 from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy.orm import Session, sessionmaker
 
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
 # def get_database_url() -> str:
 #     """Получение адреса базы данных"""
 #
@@ -14,10 +28,275 @@ load_dotenv()
 #         url_engine = os.getenv('DATABASE_URL')
 #     return url_engine
 
+
+def env_flag(name: str, default: bool) -> bool:
+    """Логический параметр из переменной окружения"""
+    value = os.getenv(name)
+    if value is None:
+        return default
+    return value.strip().lower() in {'1', 'true', 'yes', 'on'}
+
+
 db_url = os.getenv('DATABASE_URL')
 if not db_url:
     raise ValueError("DB_URL не установлен в переменных окружения")
 
-engine = create_async_engine(url=db_url, echo=True)
+POOL_OPTIONS = {
+    'echo': env_flag('DB_ECHO', False),
+    'pool_size': int(os.getenv('DB_POOL_SIZE', '10')),
+    'max_overflow': int(os.getenv('DB_MAX_OVERFLOW', '20')),
+    'pool_timeout': float(os.getenv('DB_POOL_TIMEOUT', '30')),
+    'pool_recycle': int(os.getenv('DB_POOL_RECYCLE', '1800')),
+    'pool_pre_ping': env_flag('DB_POOL_PRE_PING', True),
+}
+
+engine = create_async_engine(url=db_url, **POOL_OPTIONS)
 async_session = sessionmaker(engine, expire_on_commit=False, class_=AsyncSession)
-session = async_session()
+
+db_read_url = os.getenv('DATABASE_URL_READ')
+READ_MAX_LAG = float(os.getenv('DB_READ_MAX_LAG', '5'))
+READ_CHECK_INTERVAL = float(os.getenv('DB_READ_CHECK_INTERVAL', '1'))
+READ_CONNECT_TIMEOUT = float(os.getenv('DB_READ_CONNECT_TIMEOUT', '2'))
+READ_METHODS = frozenset({'GET', 'HEAD'})
+# Отставание реплики в секундах; 0, если реплика применила весь полученный WAL или это не реплика
+REPLICA_LAG_QUERY = (
+    'SELECT CASE WHEN NOT pg_is_in_recovery() OR pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0 '
+    'ELSE EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()) END'
+)
+
+
+class QueryStats:
+    """Число SQL-запросов, суммарное время их выполнения и число выполняемых сейчас в рамках одного HTTP-запроса"""
+
+    def __init__(self) -> None:
+        self.statements = 0
+        self.seconds = 0.0
+        self.active = 0
+
+
+query_stats: ContextVar = ContextVar('query_stats', default=None)
+
+
+def start_query_timer(conn, cursor, statement, parameters, context, executemany) -> None:
+    """Запомнить время начала запроса"""
+    context.query_started = time.perf_counter()
+    stats = query_stats.get()
+    if stats is not None:
+        stats.active += 1
+
+
+def count_query(conn, cursor, statement, parameters, context, executemany) -> None:
+    """Учесть выполненный запрос в статистике текущего HTTP-запроса"""
+    stats = query_stats.get()
+    if stats is not None:
+        stats.statements += 1
+        stats.seconds += time.perf_counter() - context.query_started
+        stats.active -= 1
+
+
+def count_failed_query(exception_context) -> None:
+    """Снять отметку выполняемого запроса, завершившегося ошибкой"""
+    stats = query_stats.get()
+    if stats is not None and exception_context.cursor is not None:
+        stats.active -= 1
+
+
+def track_queries(async_engine) -> None:
+    """Подключить учёт запросов к движку"""
+    event.listen(async_engine.sync_engine, 'before_cursor_execute', start_query_timer)
+    event.listen(async_engine.sync_engine, 'after_cursor_execute', count_query)
+    event.listen(async_engine.sync_engine, 'handle_error', count_failed_query)
+
+
+track_queries(engine)
+
+
+class ReadReplica:
+    """
+    Реплика для чтения: собственный пул соединений и состояние реплики.
+
+    Доступность и отставание раз в check_interval секунд проверяет фоновая
+    задача; запросы только читают результат последней проверки.
+    """
+
+    def __init__(self, url: str, max_lag: float = READ_MAX_LAG, check_interval: float = READ_CHECK_INTERVAL) -> None:
+        self.engine = create_async_engine(
+            url=url, connect_args={'timeout': READ_CONNECT_TIMEOUT}, **POOL_OPTIONS,
+        )
+        track_queries(self.engine)
+        self.session = sessionmaker(self.engine, expire_on_commit=False, class_=AsyncSession)
+        self.max_lag = max_lag
+        self.check_interval = check_interval
+        self.healthy = False
+        self.lag: Optional[float] = None
+        self.synced_at: Optional[float] = None
+        self._task = None
+
+    def available(self) -> bool:
+        """Доступна ли реплика и не отстаёт ли больше max_lag секунд по последней проверке"""
+        return self.healthy
+
+    def includes(self, version: str) -> bool:
+        """Применила ли реплика запись, после которой выдана версия ресурса"""
+        return self.synced_at is not None and version_time(version) <= self.synced_at
+
+    async def check(self) -> None:
+        """Проверить доступность и отставание реплики"""
+        started = time.time()
+        try:
+            async with self.engine.connect() as conn:
+                lag = await asyncio.wait_for(conn.scalar(text(REPLICA_LAG_QUERY)), READ_CONNECT_TIMEOUT)
+        except (OSError, asyncio.TimeoutError, OperationalError, InterfaceError):
+            if self.healthy:
+                logger.warning('Реплика для чтения недоступна, запросы идут на основной сервер')
+            self.healthy = False
+            return
+        self.lag = float(lag or 0)
+        self.synced_at = started - self.lag
+        self.healthy = self.lag <= self.max_lag
+
+    def mark_down(self) -> None:
+        """Считать реплику недоступной до следующей проверки"""
+        self.healthy = False
+
+    async def run(self) -> None:
+        """Проверять реплику раз в check_interval секунд до вызова stop"""
+        while True:
+            try:
+                await self.check()
+            except Exception:
+                logger.exception('Не удалось проверить реплику для чтения')
+                self.healthy = False
+            await asyncio.sleep(self.check_interval)
+
+    def start(self) -> None:
+        """Запустить фоновую проверку реплики"""
+        self._task = asyncio.create_task(self.run())
+
+    async def stop(self) -> None:
+        """Остановить фоновую проверку"""
+        task, self._task = self._task, None
+        if task is not None:
+            task.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await task
+
+
+read_replica = ReadReplica(db_read_url) if db_read_url else None
+
+
+def remember_commit(session) -> None:
+    """Отметить сессию, в которой были зафиксированы изменения"""
+    session.info['committed'] = True
+
+
+event.listen(Session, 'after_commit', remember_commit)
+
+
+class ReplicaUnavailableError(Exception):
+    """Реплика отказала во время запроса на чтение"""
+
+
+def session_factory_for(method: str, api_key: Optional[str]):
+    """
+    Фабрика сессий для HTTP-запроса.
+
+    Чтение (GET, HEAD) идёт на реплику, если она задана DATABASE_URL_READ,
+    доступна и не отстаёт, а пользователь не записывал данные последние
+    DB_READ_STICKY_SECONDS секунд. Остальное идёт на основной сервер.
+    """
+    if read_replica is None or method not in READ_METHODS:
+        return async_session
+    if api_key is not None and recent_writers.get(api_key) is not MISSING:
+        return async_session
+    if not read_replica.available():
+        return async_session
+    return read_replica.session
+
+
+async def get_session(request: Request) -> AsyncGenerator[AsyncSession, None]:
+    """
+    Отдельная сессия базы данных на время одного запроса.
+
+    После того как запрос авторизованного пользователя зафиксировал
+    изменения, чтение этого пользователя на время
+    DB_READ_STICKY_SECONDS закрепляется за основным сервером,
+    чтобы он сразу видел свои изменения.
+
+    Raises:
+        ReplicaUnavailableError: Если реплика отказала во время чтения;
+            ReplicaFallbackMiddleware повторяет такой запрос на основном сервере
+    """
+    api_key = request.headers.get('api-key')
+    factory = session_factory_for(request.method, api_key)
+    async with factory() as session:
+        try:
+            yield session
+        except (OSError, OperationalError, InterfaceError) as exc:
+            if factory is not async_session:
+                read_replica.mark_down()
+                raise ReplicaUnavailableError() from exc
+            raise
+        finally:
+            user = session.info.get('user')
+            if read_replica is not None and user is not None and session.info.get('committed'):
+                mark_writer(user.api_key)
+
+
+@contextlib.asynccontextmanager
+async def session_for_version(session, *version_keys):
+    """
+    Сессия, в которой видна последняя запись ресурсов version_keys.
+
+    Если session читает с реплики, которая ещё не применила эту запись,
+    чтение идёт на основной сервер: иначе под ETag новой версии клиент
+    получил бы старые данные и хранил бы их, получая 304.
+    """
+    on_replica = read_replica is not None and session.bind is read_replica.engine
+    if not on_replica or read_replica.includes(max(map(get_version, version_keys))):
+        yield session
+        return
+    async with async_session() as primary:
+        yield primary
+
+
+class ReplicaFallbackMiddleware:
+    """
+    ASGI-промежуточный слой: если реплика отказала во время чтения и ответ
+    ещё не начат, запрос выполняется повторно на основном сервере.
+    """
+
+    def __init__(self, app) -> None:
+        self.app = app
+
+    async def __call__(self, scope, receive, send) -> None:
+        if read_replica is None or scope['type'] != 'http' or scope['method'] not in READ_METHODS:
+            await self.app(scope, receive, send)
+            return
+        started = False
+
+        async def send_started(message) -> None:
+            nonlocal started
+            started = True
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_started)
+        except ReplicaUnavailableError:
+            if started:
+                raise
+            logger.warning('Реплика отказала во время запроса %s, повтор на основном сервере', scope['path'])
+            await self.app(scope, replay_empty_body(receive), send)
+
+
+def replay_empty_body(receive):
+    """receive для повтора запроса без тела: тело уже прочитано первой попыткой"""
+    replayed = False
+
+    async def replay():
+        nonlocal replayed
+        if not replayed:
+            replayed = True
+            return {'type': 'http.request', 'body': b'', 'more_body': False}
+        return await receive()
+    return replay
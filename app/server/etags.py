@@ -0,0 +1,34 @@
+import hashlib
+import os
+
+from cache import get_version
+from fastapi import Response
+
+FEED_CACHE_CONTROL = 'private, no-cache'
+PROFILE_CACHE_CONTROL = 'public, max-age={0}'.format(os.getenv('PROFILE_HTTP_MAX_AGE', '1'))
+ME_CACHE_CONTROL = 'private, no-cache'
+MEDIA_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+
+
+def make_etag(version_key, *parts):
+    """ETag из версии ресурса и параметров запроса"""
+    return make_multi_etag([version_key], *parts)
+
+
+def make_multi_etag(version_keys, *parts):
+    """ETag из версий нескольких ресурсов и параметров запроса"""
+    payload = ':'.join(str(part) for part in (*map(get_version, version_keys), *parts))
+    return '"{0}"'.format(hashlib.sha1(payload.encode()).hexdigest()[:20])
+
+
+def etag_matches(if_none_match, etag):
+    """Совпадает ли ETag с заголовком If-None-Match"""
+    if not if_none_match:
+        return False
+    candidates = [candidate.strip() for candidate in if_none_match.split(',')]
+    return '*' in candidates or etag in candidates or 'W/' + etag in candidates
+
+
+def not_modified(etag, cache_control):
+    """Ответ 304 Not Modified"""
+    return Response(status_code=304, headers={'ETag': etag, 'Cache-Control': cache_control})
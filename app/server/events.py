@@ -0,0 +1,207 @@
+"""
+Рассылка изменений ленты подключённым клиентам через Server-Sent Events.
+
+Клиент один раз подключается к GET /api/events и получает небольшие события
+вместо повторной загрузки всей ленты:
+
+    tweet_created  — новый твит автора, на которого подписан пользователь, в формате ленты
+    tweet_deleted  — твит удалён
+    tweet_liked    — твит отмечен как понравившийся
+    tweet_unliked  — отметка снята
+
+События о лайках и удалении рассылаются всем подключённым клиентам, они
+невелики и клиент пропускает твиты, которых у него нет. У каждого подписчика
+своя очередь из EVENTS_QUEUE_SIZE событий; если клиент не успевает их
+забирать, он отключается событием reset и должен заново загрузить ленту.
+
+Обработчики из event_listeners получают каждое событие, опубликованное
+в этом процессе, — так шина invalidation.py доставляет события клиентам,
+подключённым к другим процессам.
+"""
+import asyncio
+import itertools
+import os
+from collections import defaultdict
+
+import orjson
+from counters import int_array
+from feed import get_attachments_paths
+from models import Follow
+from sqlalchemy import any_
+from sqlalchemy.future import select
+
+EVENTS_QUEUE_SIZE = int(os.getenv('EVENTS_QUEUE_SIZE', '100'))
+EVENTS_KEEPALIVE = float(os.getenv('EVENTS_KEEPALIVE', '15'))
+EVENTS_RETRY_MS = int(os.getenv('EVENTS_RETRY_MS', '3000'))
+
+DROPPED = None
+RESET_EVENT = b'event: reset\ndata: {}\n\n'
+KEEPALIVE_COMMENT = b': keepalive\n\n'
+
+
+def format_event(event_id: int, event_type: str, data: dict) -> bytes:
+    """Событие в формате text/event-stream"""
+    return b'id: %d\nevent: %s\ndata: %s\n\n' % (event_id, event_type.encode(), orjson.dumps(data))
+
+
+class Subscriber:
+    """Подключение одного клиента с ограниченной очередью событий"""
+
+    def __init__(self, user_id: int, maxsize: int) -> None:
+        self.user_id = user_id
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize)
+        self.dropped = False
+
+    def offer(self, message: bytes) -> bool:
+        """Поставить событие в очередь, не дожидаясь клиента"""
+        try:
+            self.queue.put_nowait(message)
+        except asyncio.QueueFull:
+            return False
+        return True
+
+    def drop(self) -> None:
+        """Отбросить накопленные события и оставить только сигнал переподключения"""
+        self.dropped = True
+        while not self.queue.empty():
+            self.queue.get_nowait()
+        self.queue.put_nowait(DROPPED)
+
+
+class EventBroker:
+    """Брокер публикации-подписки внутри процесса"""
+
+    def __init__(self, maxsize: int = EVENTS_QUEUE_SIZE) -> None:
+        self.maxsize = maxsize
+        self.subscribers: defaultdict = defaultdict(set)
+        self.ids = itertools.count(1)
+        self.dropped = 0
+
+    def __len__(self) -> int:
+        return sum(len(subscribers) for subscribers in self.subscribers.values())
+
+    def subscribe(self, user_id: int) -> Subscriber:
+        """Новая подписка пользователя"""
+        subscriber = Subscriber(user_id, self.maxsize)
+        self.subscribers[user_id].add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber: Subscriber) -> None:
+        """Удалить подписку"""
+        subscribers = self.subscribers.get(subscriber.user_id)
+        if subscribers is not None:
+            subscribers.discard(subscriber)
+            if not subscribers:
+                del self.subscribers[subscriber.user_id]
+
+    def publish(self, event_type: str, data: dict, user_ids=None) -> int:
+        """
+        Разослать событие пользователям user_ids или всем подключённым.
+
+        Событие сериализуется один раз. Подписчик с переполненной очередью
+        отключается.
+
+        Returns:
+            int: Число подписок, получивших событие
+        """
+        if not self.subscribers:
+            return 0
+        message = format_event(next(self.ids), event_type, data)
+        if user_ids is None:
+            user_ids = list(self.subscribers)
+        delivered = 0
+        for user_id in user_ids:
+            for subscriber in list(self.subscribers.get(user_id, ())):
+                if subscriber.offer(message):
+                    delivered += 1
+                else:
+                    subscriber.drop()
+                    self.unsubscribe(subscriber)
+                    self.dropped += 1
+        return delivered
+
+
+event_broker = EventBroker()
+event_listeners: list = []
+
+
+def notify_event(kind: str, **data) -> None:
+    """Сообщить обработчикам о событии, опубликованном в этом процессе"""
+    for listener in event_listeners:
+        listener(kind, data)
+
+
+def broadcast(event_type: str, data: dict) -> None:
+    """Разослать событие всем подключённым клиентам во всех процессах"""
+    event_broker.publish(event_type, data)
+    notify_event('event', type=event_type, data=data)
+
+
+async def stream_events(subscriber: Subscriber, keepalive: float = EVENTS_KEEPALIVE):
+    """Поток событий подписчика; комментарий-пинг раз в keepalive секунд без событий"""
+    try:
+        yield 'retry: {0}\n\n'.format(EVENTS_RETRY_MS).encode()
+        while True:
+            try:
+                message = await asyncio.wait_for(subscriber.queue.get(), keepalive)
+            except asyncio.TimeoutError:
+                yield KEEPALIVE_COMMENT
+                continue
+            if message is DROPPED:
+                yield RESET_EVENT
+                return
+            yield message
+    finally:
+        event_broker.unsubscribe(subscriber)
+
+
+async def deliver_tweets(session, author: dict, tweets: list) -> None:
+    """
+    Разослать готовые твиты автору и его подписчикам, подключённым к этому процессу.
+
+    Пока нет подключённых клиентов, к базе данных не обращается.
+    """
+    if not event_broker.subscribers:
+        return
+    followers = await session.execute(
+        select(Follow.follower_id).where(
+            Follow.followed_id == author['id'],
+            Follow.follower_id == any_(int_array('user_ids', event_broker.subscribers)),
+        ),
+    )
+    recipients = {author['id'], *followers.scalars()}
+    for tweet in tweets:
+        event_broker.publish('tweet_created', tweet, recipients)
+
+
+async def publish_tweets(session, author, tweets) -> None:
+    """
+    Разослать новые твиты автору и его подписчикам во всех процессах.
+
+    Parameters:
+        author: Автор с атрибутами id и name
+        tweets: Строки с атрибутами id, content_data и attachments
+    """
+    if not event_broker.subscribers and not event_listeners:
+        return
+    media_ids = {int(media_id) for tweet in tweets for media_id in tweet.attachments or []}
+    attachments = await get_attachments_paths(session, media_ids)
+    author_data = {'id': author.id, 'name': author.name}
+    payloads = [
+        {
+            'id': tweet.id,
+            'content': tweet.content_data,
+            'attachments': [attachments.get(int(media_id)) for media_id in tweet.attachments or []],
+            'author': author_data,
+            'likes': [],
+        }
+        for tweet in tweets
+    ]
+    await deliver_tweets(session, author_data, payloads)
+    notify_event('tweets', author=author_data, tweets=payloads)
+
+
+def publish_likes(event_type: str, user, tweet_ids) -> None:
+    """Разослать изменения лайков пользователя: tweet_liked или tweet_unliked"""
+    for tweet_id in tweet_ids:
+        broadcast(event_type, {'tweet_id': tweet_id, 'user_id': user.id, 'name': user.name})
@@ -0,0 +1,253 @@
+import base64
+import os
+
+import orjson
+
+from cache import MISSING, following_cache
+from likes_buffer import like_buffer
+from models import Follow, Like, Media, Timeline, Tweet, User
+from sqlalchemy import ARRAY, Float, Integer, any_, bindparam, func, literal, literal_column, true, tuple_, union
+from sqlalchemy.future import select
+from timeline import FANOUT_FOLLOWERS_LIMIT
+
+FEED_PAGE_SIZE = int(os.getenv('FEED_PAGE_SIZE', '100'))
+FEED_MAX_PAGE_SIZE = int(os.getenv('FEED_MAX_PAGE_SIZE', '500'))
+SEARCH_CONFIG = 'simple'
+STREAM_CHUNK_SIZE = 100
+
+
+def encode_cursor(score, tweet_id):
+    """Непрозрачный курсор из пары (популярность или релевантность, идентификатор твита)"""
+    return base64.urlsafe_b64encode('{0}:{1}'.format(score, tweet_id).encode()).decode()
+
+
+def decode_cursor(cursor, score_type=int):
+    """
+    Разобрать курсор ленты или поиска.
+
+    Raises:
+        ValueError: Если курсор повреждён
+    """
+    try:
+        score, tweet_id = base64.urlsafe_b64decode(cursor.encode()).decode().split(':')
+        return score_type(score), int(tweet_id)
+    except (UnicodeError, TypeError, ValueError) as exc:
+        raise ValueError('Invalid cursor') from exc
+
+
+def score_position(cursor):
+    """Позиция курсора (популярность или релевантность, id) для сравнения кортежей"""
+    return tuple_(literal(cursor[0], Float), cursor[1])
+
+
+async def feed_authors(session, user_id):
+    """Авторы ленты пользователя: он сам и те, на кого он подписан; список кэшируется"""
+    authors = following_cache.get(user_id)
+    if authors is MISSING:
+        followed = await session.execute(select(Follow.followed_id).where(Follow.follower_id == user_id))
+        authors = (user_id, *followed.scalars())
+        following_cache.set(user_id, authors)
+    return authors
+
+
+def fan_out_on_read_authors(user_id):
+    """Авторы с большим числом подписчиков, на которых подписан пользователь"""
+    return select(Follow.followed_id).join(
+        User, User.id == Follow.followed_id,
+    ).where(
+        Follow.follower_id == user_id,
+        User.followers_count > FANOUT_FOLLOWERS_LIMIT,
+    )
+
+
+def timeline_tweets_query(user_id, limit, cursor=None):
+    """
+    Твиты-кандидаты страницы ленты с их популярностью.
+
+    Из сохранённой ленты берутся limit лучших записей по индексу
+    (user_id, score DESC, tweet_id DESC) после курсора, у каждого популярного
+    автора — limit лучших по индексу (user_id, score, id): остальные твиты
+    на страницу всё равно не попадут.
+    """
+    stored = select(Timeline.tweet_id.label('id'), Timeline.score).where(Timeline.user_id == user_id)
+    if cursor:
+        stored = stored.where(tuple_(Timeline.score, Timeline.tweet_id) < score_position(cursor))
+    stored = stored.order_by(Timeline.score.desc(), Timeline.tweet_id.desc()).limit(limit)
+    authors = fan_out_on_read_authors(user_id).subquery()
+    author_top = select(Tweet.id, Tweet.score).where(Tweet.user_id == authors.c.followed_id)
+    if cursor:
+        author_top = author_top.where(tuple_(Tweet.score, Tweet.id) < score_position(cursor))
+    author_top = author_top.order_by(Tweet.score.desc(), Tweet.id.desc()).limit(limit).lateral()
+    return union(
+        stored,
+        select(author_top.c.id, author_top.c.score).select_from(authors).join(author_top, true()),
+    )
+
+
+def feed_query(user_id, limit, cursor=None):
+    """
+    Запрос страницы ленты пользователя, отсортированной по популярности твитов.
+
+    Популярность хранится в tweets.score и timelines.score (см. ranking.py).
+    Сохранённая лента читается по индексу уже упорядоченной и обрезанной
+    до limit записей, поэтому её размер не влияет на стоимость запроса.
+    Кандидатов от популярных авторов не больше limit на автора, из них
+    и ленты PostgreSQL выбирает limit лучших частичной сортировкой (top-N heapsort).
+    Страницы выбираются по ключу (популярность, идентификатор твита),
+    а не через OFFSET, поэтому стоимость запроса не растёт с номером страницы.
+    """
+    candidates = timeline_tweets_query(user_id, limit, cursor).subquery()
+    page = select(candidates).order_by(candidates.c.score.desc(), candidates.c.id.desc()).limit(limit).subquery()
+    return select(
+        Tweet.id,
+        Tweet.content_data,
+        Tweet.attachments,
+        User.id.label('author_id'),
+        User.name.label('author_name'),
+        page.c.score,
+    ).join_from(
+        page, Tweet, Tweet.id == page.c.id,
+    ).join(
+        User, User.id == Tweet.user_id,
+    ).order_by(page.c.score.desc(), page.c.id.desc())
+
+
+def search_query(text, limit, cursor=None):
+    """
+    Запрос страницы результатов полнотекстового поиска по твитам.
+
+    Совпадения находятся по GIN-индексу на tweets.search_vector, результаты
+    упорядочены по релевантности и листаются по ключу (релевантность, id).
+    """
+    query = func.websearch_to_tsquery(literal_column("'{0}'::regconfig".format(SEARCH_CONFIG)), text)
+    found = select(
+        Tweet.id,
+        Tweet.content_data,
+        Tweet.attachments,
+        User.id.label('author_id'),
+        User.name.label('author_name'),
+        func.ts_rank(Tweet.search_vector, query).label('score'),
+    ).join(
+        User, User.id == Tweet.user_id,
+    ).where(
+        Tweet.search_vector.bool_op('@@')(query),
+    ).subquery()
+    page = select(found)
+    if cursor:
+        page = page.where(tuple_(found.c.score, found.c.id) < score_position(cursor))
+    return page.order_by(found.c.score.desc(), found.c.id.desc()).limit(limit)
+
+
+async def get_likes_for_tweets(session, tweet_ids):
+    """Лайки с именами пользователей для набора твитов одним запросом"""
+    likes = {tweet_id: [] for tweet_id in tweet_ids}
+    if not tweet_ids:
+        return likes
+    likes_data = await session.execute(
+        select(Like.tweet_id, User.id, User.name).join(
+            User, User.id == Like.user_id,
+        ).where(
+            Like.tweet_id == any_(bindparam('tweet_ids', tweet_ids, type_=ARRAY(Integer))),
+        ),
+    )
+    for tweet_id, user_id, name in likes_data:
+        likes[tweet_id].append({
+            'user_id': user_id,
+            'name': name,
+        })
+    return likes
+
+
+async def get_attachments_paths(session, media_ids, size=None):
+    """
+    Пути к файлам медиа для набора идентификаторов одним запросом.
+
+    Если задан size и вариант изображения уже построен, возвращается путь
+    к варианту, иначе к оригиналу.
+    """
+    if not media_ids:
+        return {}
+    media_data = await session.execute(
+        select(Media.id, Media.path_file, Media.variants).where(
+            Media.id == any_(bindparam('media_ids', list(media_ids), type_=ARRAY(Integer))),
+        ),
+    )
+    return {
+        media_id: (variants or {}).get(size, path_file)
+        for media_id, path_file, variants in media_data
+    }
+
+
+async def get_tweets_info(session, rows, size=None, viewer=None):
+    """
+    Сборка твитов в формат ответа API за фиксированное число запросов.
+
+    Если передан viewer, в лайках учитываются его ещё не сохранённые изменения.
+    """
+    tweet_ids = [row.id for row in rows]
+    media_ids = {int(media_id) for row in rows for media_id in row.attachments or []}
+    likes = await get_likes_for_tweets(session, tweet_ids)
+    if viewer is not None:
+        like_buffer.overlay_likes(likes, viewer.id, viewer.name)
+    attachments = await get_attachments_paths(session, media_ids, size)
+
+    return [
+        {
+            'id': row.id,
+            'content': row.content_data,
+            'attachments': [
+                attachments.get(int(media_id)) for media_id in row.attachments or []
+            ],
+            'author': {
+                'id': row.author_id,
+                'name': row.author_name,
+            },
+            'likes': likes[row.id],
+        }
+        for row in rows
+    ]
+
+
+async def get_feed(session, user_id, limit=FEED_PAGE_SIZE, cursor=None, size=None, viewer=None):
+    """
+    Страница ленты пользователя за постоянное число запросов к базе данных.
+
+    Returns:
+        tuple: Твиты страницы и курсор следующей страницы (None для последней)
+    """
+    tweets_data = await session.execute(feed_query(user_id, limit + 1, cursor))
+    rows = tweets_data.all()
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(rows[-1].score, rows[-1].id)
+    return await get_tweets_info(session, rows, size, viewer), next_cursor
+
+
+async def search_tweets(session, text, limit=FEED_PAGE_SIZE, cursor=None, size=None, viewer=None):
+    """
+    Страница результатов поиска в формате ленты.
+
+    Returns:
+        tuple: Твиты страницы и курсор следующей страницы (None для последней)
+    """
+    found = await session.execute(search_query(text, limit + 1, cursor))
+    rows = found.all()
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(rows[-1].score, rows[-1].id)
+    return await get_tweets_info(session, rows, size, viewer), next_cursor
+
+
+async def stream_feed(tweets, next_cursor):
+    """
+    Постепенная отдача страницы ленты в формате JSON.
+
+    Твиты сериализуются через orjson пачками по STREAM_CHUNK_SIZE,
+    чтобы не отправлять отдельное сообщение ASGI на каждый твит.
+    """
+    yield b'{"result":true,"tweets":['
+    for start in range(0, len(tweets), STREAM_CHUNK_SIZE):
+        yield (b',' if start else b'') + orjson.dumps(tweets[start:start + STREAM_CHUNK_SIZE])[1:-1]
+    yield b'],"next_cursor":' + orjson.dumps(next_cursor) + b'}'
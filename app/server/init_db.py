@@ -1,31 +1,28 @@
 import asyncio
 
-from models import Base, User
-from sqlalchemy import select
+from migrations import migrate
+from models import User
+from sqlalchemy.dialects.postgresql import insert
 
-from database import engine, async_session
+from database import async_session
 
 
 async def init_db() -> None:
-    """Создание базы данных"""
-    async with engine.begin() as conn:
-        await conn.run_sync(Base.metadata.create_all)
+    """Создание базы данных и применение миграций"""
+    await migrate()
 
 
 async def add_test_user() -> None:
-    """Добавление тестовых пользователей в базу данных"""
+    """Добавление тестовых пользователей в базу данных одним запросом"""
     async with async_session() as session:
-        existing_users = await session.execute(select(User.name))
-        existing_users_names = set(existing_users.scalars().all())
-        new_users = [
-            User(name='test_user', api_key='test'),
-            User(name='222_user', api_key='222'),
-            User(name='333_user', api_key='333'),
-        ]
-        for user in new_users:
-            if user.name not in existing_users_names:
-                session.add_all(user)
-                await session.commit()
+        await session.execute(
+            insert(User).values([
+                {'name': 'test_user', 'api_key': 'test'},
+                {'name': '222_user', 'api_key': '222'},
+                {'name': '333_user', 'api_key': '333'},
+            ]).on_conflict_do_nothing(),
+        )
+        await session.commit()
 
 
 async def main() -> None:
@@ -0,0 +1,233 @@
+"""
+Шина инвалидации кэшей между процессами на PostgreSQL LISTEN/NOTIFY.
+
+При нескольких процессах сервера (WEB_CONCURRENCY > 1) у каждого свои кэши
+авторизации, профилей и версий ETag и свой брокер событий. Шина рассылает
+каждую инвалидацию и каждое событие для клиентов через канал
+INVALIDATION_CHANNEL, а остальные процессы применяют их у себя. Сообщение
+содержит новую версию ресурса, поэтому все процессы выдают одинаковые ETag.
+
+Новые версии также сохраняются в таблицу cache_versions. Шина держит
+отдельное соединение asyncpg вне пула. При каждом подключении, в том числе
+после потери соединения, кэши процесса сбрасываются, так как часть сообщений
+могла быть пропущена, а версии загружаются из cache_versions: процессы
+сходятся к одним и тем же ETag без изменений данных.
+"""
+import asyncio
+import logging
+import os
+import secrets
+from collections import deque
+
+import asyncpg
+import orjson
+from cache import (
+    INITIAL_VERSION,
+    apply_invalidation,
+    author_version,
+    invalidation_listeners,
+    parse_version_name,
+    profile_version,
+    reset_caches,
+    timeline_version,
+    version_cache,
+    version_name,
+)
+from database import async_session, engine, env_flag
+from events import deliver_tweets, event_broker, event_listeners
+
+logger = logging.getLogger(__name__)
+
+WORKERS = int(os.getenv('WEB_CONCURRENCY', '1'))
+INVALIDATION_BUS_ENABLED = env_flag('INVALIDATION_BUS', WORKERS > 1)
+INVALIDATION_CHANNEL = os.getenv('INVALIDATION_CHANNEL', 'cache_invalidation')
+INVALIDATION_RECONNECT = float(os.getenv('INVALIDATION_RECONNECT', '1'))
+# Ограничение PostgreSQL на размер сообщения NOTIFY — 8000 байт
+NOTIFY_MAX_BYTES = 7900
+# Версий лент в одном сообщении: так оно заведомо меньше NOTIFY_MAX_BYTES
+FEEDS_MESSAGE_KEYS = 100
+SAVE_VERSIONS_SQL = (
+    'INSERT INTO cache_versions (key, version) SELECT * FROM unnest($1::varchar[], $2::varchar[]) '
+    'ON CONFLICT (key) DO UPDATE SET version = greatest(cache_versions.version, excluded.version)'
+)
+LOAD_VERSIONS_SQL = 'SELECT key, version FROM cache_versions ORDER BY version DESC LIMIT $1'
+
+
+def listen_dsn(target_engine) -> str:
+    """Адрес базы данных для asyncpg по адресу движка SQLAlchemy"""
+    return target_engine.url.set(drivername='postgresql').render_as_string(hide_password=False)
+
+
+def message_versions(message: dict) -> list:
+    """Пары (ключ, версия) из сообщения об инвалидации для таблицы cache_versions"""
+    if message['kind'] == 'profiles':
+        return [
+            (version_name(profile_version(user_id)), version)
+            for user_id, version in zip(message['user_ids'], message['versions'])
+        ]
+    if message['kind'] == 'feeds':
+        return [
+            *((version_name(timeline_version(int(user_id))), version) for user_id, version in message['timelines'].items()),
+            *((version_name(author_version(int(user_id))), version) for user_id, version in message['authors'].items()),
+        ]
+    return []
+
+
+async def load_versions(connection) -> None:
+    """
+    Сбросить кэши процесса и загрузить последние версии из cache_versions.
+
+    Если в таблице больше версий, чем помещается в кэш, остальные ресурсы
+    получают самую старую из загруженных: их настоящие версии не новее её.
+    """
+    rows = await connection.fetch(LOAD_VERSIONS_SQL, version_cache.maxsize)
+    floor = rows[-1]['version'] if len(rows) == version_cache.maxsize else INITIAL_VERSION
+    reset_caches([(parse_version_name(row['key']), row['version']) for row in rows], floor)
+
+
+class InvalidationBus:
+    """
+    Рассылка инвалидаций и событий этого процесса и применение чужих.
+
+    Исходящие сообщения копятся в очереди и отправляются фоновой задачей;
+    смены версий лент, накопившиеся до отправки, объединяются в сообщения
+    не более чем по FEEDS_MESSAGE_KEYS версий.
+    """
+
+    def __init__(self, dsn: str, channel: str = INVALIDATION_CHANNEL, enabled: bool = INVALIDATION_BUS_ENABLED) -> None:
+        self.dsn = dsn
+        self.channel = channel
+        self.enabled = enabled
+        self.origin = secrets.token_hex(8)
+        self.sent = 0
+        self.received = 0
+        self._outbox: deque = deque()
+        self._pending_feeds = None
+        self._wakeup = None
+        self._connected = None
+        self._task = None
+        self._deliveries: set = set()
+
+    def on_invalidation(self, kind: str, data: dict) -> None:
+        """Поставить в очередь инвалидацию этого процесса"""
+        if kind != 'feeds':
+            self._enqueue({'origin': self.origin, 'kind': kind, **data})
+            return
+        for group in ('timelines', 'authors'):
+            for key, version in data[group].items():
+                message = self._pending_feeds
+                if message is None or len(message['timelines']) + len(message['authors']) >= FEEDS_MESSAGE_KEYS:
+                    message = {'origin': self.origin, 'kind': kind, 'timelines': {}, 'authors': {}}
+                    self._pending_feeds = message
+                    self._enqueue(message)
+                message[group][key] = max(message[group].get(key, version), version)
+
+    def on_event(self, kind: str, data: dict) -> None:
+        """Поставить в очередь событие для клиентов; новые твиты — по одному на сообщение"""
+        if kind == 'tweets':
+            for tweet in data['tweets']:
+                self._enqueue({'origin': self.origin, 'kind': kind, 'author': data['author'], 'tweets': [tweet]})
+        else:
+            self._enqueue({'origin': self.origin, 'kind': kind, **data})
+
+    def _enqueue(self, message: dict) -> None:
+        self._outbox.append(message)
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    def receive(self, connection, pid, channel, payload) -> None:
+        """Применить сообщение другого процесса"""
+        message = orjson.loads(payload)
+        if message.pop('origin', None) == self.origin:
+            return
+        self.received += 1
+        kind = message.pop('kind')
+        if kind == 'event':
+            event_broker.publish(message['type'], message['data'])
+        elif kind == 'tweets':
+            if event_broker.subscribers:
+                task = asyncio.create_task(self.deliver(message['author'], message['tweets']))
+                self._deliveries.add(task)
+                task.add_done_callback(self._deliveries.discard)
+        else:
+            apply_invalidation(kind, message)
+
+    async def deliver(self, author: dict, tweets: list) -> None:
+        """Разослать твиты другого процесса подписчикам, подключённым к этому"""
+        try:
+            async with async_session() as session:
+                await deliver_tweets(session, author, tweets)
+        except Exception:
+            logger.exception('Не удалось разослать твиты автора %s', author['id'])
+
+    async def send_pending(self, connection) -> None:
+        """Отправить накопленные сообщения; неотправленные остаются в очереди"""
+        while self._outbox:
+            message = self._outbox[0]
+            if message is self._pending_feeds:
+                self._pending_feeds = None
+            payload = orjson.dumps(message).decode()
+            if len(payload.encode()) > NOTIFY_MAX_BYTES:
+                logger.warning('Сообщение %s больше %s байт и не отправлено', message['kind'], NOTIFY_MAX_BYTES)
+            else:
+                versions = message_versions(message)
+                if versions:
+                    await connection.execute(SAVE_VERSIONS_SQL, *map(list, zip(*versions)))
+                await connection.execute('SELECT pg_notify($1, $2)', self.channel, payload)
+                self.sent += 1
+            self._outbox.popleft()
+
+    async def serve(self) -> None:
+        """Слушать канал и отправлять сообщения, пока соединение живо и шина не остановлена"""
+        connection = await asyncpg.connect(self.dsn)
+        try:
+            await connection.add_listener(self.channel, self.receive)
+            connection.add_termination_listener(lambda _: self._wakeup.set())
+            await load_versions(connection)
+            self._connected.set()
+            while self._task is not None:
+                await self._wakeup.wait()
+                self._wakeup.clear()
+                if connection.is_closed():
+                    raise ConnectionError('Соединение шины инвалидации закрыто')
+                await self.send_pending(connection)
+            await self.send_pending(connection)
+        finally:
+            self._connected.clear()
+            await connection.close(timeout=1)
+
+    async def run(self) -> None:
+        """Работа шины с переподключением до вызова stop"""
+        while self._task is not None:
+            try:
+                await self.serve()
+            except Exception:
+                logger.exception('Шина инвалидации потеряла соединение')
+                await asyncio.sleep(INVALIDATION_RECONNECT)
+
+    async def start(self) -> None:
+        """Подключиться к каналу и начать рассылку инвалидаций этого процесса"""
+        self._wakeup = asyncio.Event()
+        self._connected = asyncio.Event()
+        invalidation_listeners.append(self.on_invalidation)
+        event_listeners.append(self.on_event)
+        self._task = asyncio.create_task(self.run())
+        try:
+            await asyncio.wait_for(self._connected.wait(), 10)
+        except asyncio.TimeoutError:
+            logger.warning('Шина инвалидации не подключилась, повторные попытки продолжаются')
+
+    async def stop(self) -> None:
+        """Отправить оставшиеся сообщения и отключиться"""
+        task, self._task = self._task, None
+        if task is None:
+            return
+        invalidation_listeners.remove(self.on_invalidation)
+        event_listeners.remove(self.on_event)
+        self._wakeup.set()
+        await task
+        for delivery in list(self._deliveries):
+            await delivery
+
+
+invalidation_bus = InvalidationBus(listen_dsn(engine))
@@ -0,0 +1,137 @@
+import asyncio
+import contextlib
+import logging
+import os
+
+from cache import MISSING, invalidate_feeds
+from counters import add_like_pairs, remove_like_pairs, tweet_authors
+from database import async_session, env_flag
+from rescoring import score_refresher
+
+logger = logging.getLogger(__name__)
+
+LIKE_BUFFER_ENABLED = env_flag('LIKE_BUFFER_ENABLED', False)
+LIKE_BUFFER_SIZE = int(os.getenv('LIKE_BUFFER_SIZE', '1000'))
+LIKE_BUFFER_INTERVAL = float(os.getenv('LIKE_BUFFER_INTERVAL', '1'))
+
+
+class LikeBuffer:
+    """
+    Буфер отложенной записи лайков.
+
+    Для каждой пары (пользователь, твит) хранится только последнее
+    состояние, поэтому лайк и последующая отмена взаимно погашаются.
+    Буфер сбрасывается в базу данных пачкой по достижении maxsize записей,
+    раз в interval секунд и при остановке приложения.
+
+    Буфер свой у каждого процесса: при WEB_CONCURRENCY > 1 несохранённый лайк
+    виден его автору только в ответах того же процесса, в остальных —
+    после сброса буфера.
+    """
+
+    def __init__(self, maxsize: int, interval: float, enabled: bool) -> None:
+        self.maxsize = maxsize
+        self.interval = interval
+        self.enabled = enabled
+        self._pending: dict = {}
+        self._flushing: dict = {}
+        self._lock = asyncio.Lock()
+        self._wakeup = None
+        self._task = None
+
+    def __len__(self) -> int:
+        return len(self._pending)
+
+    def record(self, user_id, tweet_id, liked):
+        """Запомнить новое состояние лайка"""
+        self._pending[(user_id, tweet_id)] = liked
+        if len(self._pending) >= self.maxsize and self._wakeup is not None:
+            self._wakeup.set()
+
+    def discard(self, user_id, tweet_ids):
+        """Забыть несохранённые изменения пользователя, записанные в базу данных напрямую"""
+        for tweet_id in tweet_ids:
+            self._pending.pop((user_id, tweet_id), None)
+
+    @contextlib.asynccontextmanager
+    async def bypass(self, user_id, tweet_ids):
+        """
+        Записать лайки пользователя напрямую, минуя буфер.
+
+        Несохранённые изменения этих пар забываются, а сброс буфера ждёт
+        окончания блока и уже начатый сброс завершается до его начала,
+        поэтому устаревшее состояние из буфера не перезапишет новое.
+        """
+        async with self._lock:
+            self.discard(user_id, tweet_ids)
+            yield
+
+    def state(self, user_id, tweet_id):
+        """Несохранённое состояние лайка или MISSING"""
+        key = (user_id, tweet_id)
+        return self._pending.get(key, self._flushing.get(key, MISSING))
+
+    def overlay_likes(self, likes, user_id, user_name):
+        """Учесть несохранённые лайки пользователя в списках лайков твитов"""
+        if not self._pending and not self._flushing:
+            return
+        for tweet_id, tweet_likes in likes.items():
+            liked = self.state(user_id, tweet_id)
+            if liked is MISSING:
+                continue
+            tweet_likes[:] = [like for like in tweet_likes if like['user_id'] != user_id]
+            if liked:
+                tweet_likes.append({'user_id': user_id, 'name': user_name})
+
+    async def flush(self):
+        """
+        Записать накопленные изменения в базу данных одной транзакцией.
+
+        Returns:
+            int: Количество сохранённых пар (пользователь, твит)
+        """
+        async with self._lock:
+            if not self._pending:
+                return 0
+            self._flushing, self._pending = self._pending, {}
+            try:
+                async with async_session() as session:
+                    await add_like_pairs(session, [key for key, liked in self._flushing.items() if liked])
+                    await remove_like_pairs(session, [key for key, liked in self._flushing.items() if not liked])
+                    authors = await tweet_authors(session, [tweet_id for _, tweet_id in self._flushing])
+                    await session.commit()
+            except Exception:
+                logger.exception('Не удалось сохранить %s лайков', len(self._flushing))
+                self._pending = {**self._flushing, **self._pending}
+                return 0
+            finally:
+                flushed, self._flushing = self._flushing, {}
+        score_refresher.mark_tweets(tweet_id for _, tweet_id in flushed)
+        invalidate_feeds(author_ids=authors)
+        return len(flushed)
+
+    async def run(self):
+        """Периодический сброс буфера до вызова stop"""
+        while self._task is not None:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            await self.flush()
+
+    def start(self):
+        """Запустить фоновый сброс буфера"""
+        self._wakeup = asyncio.Event()
+        self._task = asyncio.create_task(self.run())
+
+    async def stop(self):
+        """Остановить фоновый сброс и записать оставшиеся изменения"""
+        task, self._task = self._task, None
+        if task is not None:
+            self._wakeup.set()
+            await task
+        await self.flush()
+
+
+like_buffer = LikeBuffer(LIKE_BUFFER_SIZE, LIKE_BUFFER_INTERVAL, LIKE_BUFFER_ENABLED)
@@ -1,15 +1,63 @@
+import asyncio
 from contextlib import asynccontextmanager
 from typing import AsyncGenerator
-from database import engine
+from database import ReplicaFallbackMiddleware, engine, read_replica
 from fastapi import FastAPI
+from fastapi.responses import ORJSONResponse, PlainTextResponse
+from invalidation import invalidation_bus
+from likes_buffer import like_buffer
+from media_delivery import media_router
+from metrics import METRICS_CONTENT_TYPE, MetricsMiddleware, registry
+from profiler import ProfilerMiddleware, admin_router
+from rescoring import score_refresher
 from routes import router
+from thumbnails import shutdown_executor
+from warmup import WARMUP_ENABLED, readiness, run_warmup
 
 
 @asynccontextmanager
 async def lifespan(app: FastAPI) -> AsyncGenerator[None, None]:
+    if read_replica is not None:
+        read_replica.start()
+    if invalidation_bus.enabled:
+        await invalidation_bus.start()
+    if like_buffer.enabled:
+        like_buffer.start()
+    score_refresher.start()
+    warmup_task = None
+    if WARMUP_ENABLED:
+        warmup_task = asyncio.create_task(run_warmup())
+    else:
+        readiness.mark_ready(0.0)
     yield
+    if warmup_task is not None:
+        warmup_task.cancel()
+    await like_buffer.stop()
+    await score_refresher.stop()
+    await invalidation_bus.stop()
+    shutdown_executor()
     await engine.dispose()
+    if read_replica is not None:
+        await read_replica.stop()
+        await read_replica.engine.dispose()
 
 
-app = FastAPI(lifespan=lifespan)
+app = FastAPI(lifespan=lifespan, default_response_class=ORJSONResponse)
+app.add_middleware(ReplicaFallbackMiddleware)
+app.add_middleware(ProfilerMiddleware)
+app.add_middleware(MetricsMiddleware)
 app.include_router(router, prefix='/api')
+app.include_router(admin_router)
+app.include_router(media_router)
+
+
+@app.get('/metrics', include_in_schema=False)
+async def metrics() -> PlainTextResponse:
+    """Метрики в формате Prometheus"""
+    return PlainTextResponse(registry.render(), media_type=METRICS_CONTENT_TYPE)
+
+
+@app.get('/ready', include_in_schema=False)
+async def ready() -> ORJSONResponse:
+    """Готовность к трафику: 503, пока не закончен прогрев соединений и запросов"""
+    return ORJSONResponse(readiness.status(), status_code=200 if readiness.ready else 503)
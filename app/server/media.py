@@ -0,0 +1,98 @@
+import hashlib
+import os
+import re
+import tempfile
+
+import aiofiles
+from PIL import Image, ImageOps
+
+MEDIA_ROOT = os.getenv('MEDIA_ROOT', './images')
+MEDIA_MAX_BYTES = int(os.getenv('MEDIA_MAX_BYTES', str(10 * 1024 * 1024)))
+MEDIA_CHUNK_SIZE = int(os.getenv('MEDIA_CHUNK_SIZE', str(64 * 1024)))
+# Наибольшая сторона изображения в пикселях для каждого варианта
+MEDIA_VARIANTS = {
+    'thumbnail': 150,
+    'feed': 600,
+    'full': 1600,
+}
+
+
+class MediaTooLargeError(Exception):
+    """Файл превышает допустимый размер"""
+
+
+def media_extension(filename):
+    """Расширение исходного файла, если оно безопасно для имени на диске"""
+    extension = os.path.splitext(filename or '')[1].lower()
+    return extension if re.fullmatch(r'\.[a-z0-9]{1,10}', extension) else ''
+
+
+async def store_upload(file_media):
+    """
+    Сохранить загруженный файл по хэшу содержимого.
+
+    Файл копируется на диск частями по MEDIA_CHUNK_SIZE байт с одновременным
+    подсчётом SHA-256, поэтому в памяти не держится целиком. Одинаковые файлы
+    хранятся в одном экземпляре.
+
+    Returns:
+        str: Путь к файлу вида ./images/ab/abcdef....jpg
+
+    Raises:
+        MediaTooLargeError: Если файл больше MEDIA_MAX_BYTES
+    """
+    os.makedirs(MEDIA_ROOT, exist_ok=True)
+    temp_fd, temp_path = tempfile.mkstemp(dir=MEDIA_ROOT, suffix='.part')
+    os.close(temp_fd)
+    digest = hashlib.sha256()
+    size = 0
+    try:
+        async with aiofiles.open(temp_path, 'wb') as outfile:
+            chunk = await file_media.read(MEDIA_CHUNK_SIZE)
+            while chunk:
+                size += len(chunk)
+                if size > MEDIA_MAX_BYTES:
+                    raise MediaTooLargeError
+                digest.update(chunk)
+                await outfile.write(chunk)
+                chunk = await file_media.read(MEDIA_CHUNK_SIZE)
+        name = digest.hexdigest()
+        filelocation = os.path.join(MEDIA_ROOT, name[:2], name + media_extension(file_media.filename))
+        if os.path.exists(filelocation):
+            os.remove(temp_path)
+        else:
+            os.makedirs(os.path.dirname(filelocation), exist_ok=True)
+            os.replace(temp_path, filelocation)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+    return filelocation
+
+
+def render_variants(filelocation):
+    """
+    Построить уменьшенные варианты изображения рядом с оригиналом.
+
+    Выполняется в отдельном процессе. Уже построенные варианты повторно
+    не пересчитываются, так как имя файла определяется хэшем оригинала.
+
+    Returns:
+        dict: Пути к вариантам по их названиям
+    """
+    variants = {}
+    base_path = os.path.splitext(filelocation)[0]
+    with Image.open(filelocation) as original:
+        image = ImageOps.exif_transpose(original)
+        has_alpha = image.mode in {'RGBA', 'LA', 'P'}
+        extension, image_format = ('.png', 'PNG') if has_alpha else ('.jpg', 'JPEG')
+        if not has_alpha:
+            image = image.convert('RGB')
+        for name, max_side in MEDIA_VARIANTS.items():
+            variant_path = '{0}.{1}{2}'.format(base_path, name, extension)
+            if not os.path.exists(variant_path):
+                variant = image.copy()
+                variant.thumbnail((max_side, max_side))
+                variant.save(variant_path, image_format, optimize=True)
+            variants[name] = variant_path
+    return variants
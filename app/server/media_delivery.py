@@ -0,0 +1,148 @@
+"""
+Отдача загруженных медиа-файлов приложением.
+
+Основной путь — location /images/ в nginx клиента (sendfile, open_file_cache).
+Маршрут ниже нужен, когда сервер API доступен напрямую: он отдаёт те же
+файлы с теми же заголовками кэширования, поддерживает Range и If-None-Match,
+а при поддержке сервером расширения ASGI http.response.pathsend передаёт
+файл без копирования через процесс Python.
+"""
+import mimetypes
+import os
+import re
+from email.utils import formatdate
+from typing import Optional
+
+import anyio
+from etags import MEDIA_CACHE_CONTROL, etag_matches, not_modified
+from fastapi import APIRouter, Header, HTTPException, Response
+from media import MEDIA_CHUNK_SIZE, MEDIA_ROOT
+
+CONTENT_NAME = re.compile(r'[0-9a-f]{64}(\.[a-z]+)?\.[a-z0-9]{1,10}')
+RANGE = re.compile(r'bytes=(\d*)-(\d*)')
+
+
+def media_file(file_path: str) -> str:
+    """
+    Путь к файлу медиа на диске.
+
+    Raises:
+        HTTPException: Если путь выходит за MEDIA_ROOT или файла нет
+    """
+    root = os.path.realpath(MEDIA_ROOT)
+    path = os.path.realpath(os.path.join(root, file_path))
+    if not path.startswith(root + os.sep) or path.endswith('.part') or not os.path.isfile(path):
+        raise HTTPException(status_code=404, detail='No media with this path')
+    return path
+
+
+def media_etag(path: str, stat_result: os.stat_result) -> str:
+    """
+    ETag файла: имя файла содержит хэш содержимого и не меняется,
+    для прочих файлов — время изменения и размер.
+    """
+    name = os.path.basename(path)
+    if CONTENT_NAME.fullmatch(name):
+        return '"{0}"'.format(name)
+    return '"{0:x}-{1:x}"'.format(int(stat_result.st_mtime), stat_result.st_size)
+
+
+def byte_range(range_header: Optional[str], size: int) -> Optional[tuple]:
+    """
+    Границы запрошенного диапазона байт (начало, конец включительно).
+
+    Несколько диапазонов и нераспознанный заголовок игнорируются — отдаётся
+    весь файл, как допускает RFC 9110.
+
+    Raises:
+        HTTPException: 416, если диапазон за пределами файла
+    """
+    match = RANGE.fullmatch((range_header or '').strip())
+    if not match or not any(match.groups()):
+        return None
+    start, end = match.groups()
+    if not start:
+        start, end = max(size - int(end), 0), size - 1
+    else:
+        start, end = int(start), min(int(end), size - 1) if end else size - 1
+    if start >= size or start > end:
+        raise HTTPException(
+            status_code=416, detail='Range not satisfiable', headers={'Content-Range': 'bytes */{0}'.format(size)},
+        )
+    return start, end
+
+
+class MediaFileResponse(Response):
+    """Файл целиком или диапазон байт, прочитанный частями по MEDIA_CHUNK_SIZE"""
+
+    def __init__(self, path: str, headers: dict, status_code: int = 200, start: int = 0, length: int = 0) -> None:
+        super().__init__(status_code=status_code, headers=headers)
+        self.path = path
+        self.start = start
+        self.length = length
+
+    async def __call__(self, scope, receive, send) -> None:
+        await send({'type': 'http.response.start', 'status': self.status_code, 'headers': self.raw_headers})
+        if scope['method'] == 'HEAD':
+            await send({'type': 'http.response.body', 'body': b''})
+            return
+        if self.status_code == 200 and 'http.response.pathsend' in scope.get('extensions', {}):
+            await send({'type': 'http.response.pathsend', 'path': self.path})
+            return
+        remaining = self.length
+        async with await anyio.open_file(self.path, 'rb') as file:
+            await file.seek(self.start)
+            while remaining:
+                chunk = await file.read(min(MEDIA_CHUNK_SIZE, remaining))
+                remaining = remaining - len(chunk) if chunk else 0
+                await send({'type': 'http.response.body', 'body': chunk, 'more_body': bool(remaining)})
+        if self.length == 0:
+            await send({'type': 'http.response.body', 'body': b''})
+
+
+media_router = APIRouter()
+
+
+@media_router.api_route('/images/{file_path:path}', methods=['GET', 'HEAD'], include_in_schema=False)
+async def get_media(
+    file_path: str,
+    range_header: Optional[str] = Header(default=None, alias='range'),
+    if_range: Optional[str] = Header(default=None, alias='if-range'),
+    if_none_match: Optional[str] = Header(default=None, alias='if-none-match'),
+):
+    """
+    Файл медиа с неизменяемым адресом
+
+    Parameters:
+        file_path (str): путь к файлу внутри MEDIA_ROOT
+        range_header (str): диапазон байт вида bytes=начало-конец
+        if_range (str): ETag, при совпадении которого учитывается Range
+        if_none_match (str): ETag ранее полученного файла
+
+    Returns:
+        Response: Файл (200), диапазон (206) или 304, если файл не изменился
+
+    Raises:
+        HTTPException: Если файла нет или диапазон за пределами файла
+    """
+    path = media_file(file_path)
+    stat_result = await anyio.to_thread.run_sync(os.stat, path)
+    etag = media_etag(path, stat_result)
+    if etag_matches(if_none_match, etag):
+        return not_modified(etag, MEDIA_CACHE_CONTROL)
+    size = stat_result.st_size
+    headers = {
+        'ETag': etag,
+        'Cache-Control': MEDIA_CACHE_CONTROL,
+        'Last-Modified': formatdate(stat_result.st_mtime, usegmt=True),
+        'Accept-Ranges': 'bytes',
+        'Content-Type': mimetypes.guess_type(path)[0] or 'application/octet-stream',
+    }
+    selected = byte_range(range_header, size) if if_range in (None, etag) else None
+    if selected is None:
+        headers['Content-Length'] = str(size)
+        return MediaFileResponse(path, headers, length=size)
+    start, end = selected
+    headers['Content-Range'] = 'bytes {0}-{1}/{2}'.format(start, end, size)
+    headers['Content-Length'] = str(end - start + 1)
+    return MediaFileResponse(path, headers, status_code=206, start=start, length=end - start + 1)
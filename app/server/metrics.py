@@ -0,0 +1,145 @@
+import bisect
+import time
+from collections import defaultdict
+
+import database
+from database import QueryStats, env_flag, query_stats
+
+DEBUG_HEADERS = env_flag('DEBUG', False)
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+STATEMENT_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21, 34, 55, 89)
+METRICS_CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+class Histogram:
+    """Гистограмма в формате Prometheus: счётчики по верхним границам корзин, сумма и количество"""
+
+    def __init__(self, buckets: tuple) -> None:
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        """Учесть наблюдение"""
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def render(self, name: str, labels: str) -> list:
+        """Строки экспозиции: накопленные корзины, _sum и _count"""
+        lines = []
+        cumulative = 0
+        for bound, count in zip((*self.buckets, '+Inf'), self.counts):
+            cumulative += count
+            lines.append('{0}_bucket{{{1},le="{2}"}} {3}'.format(name, labels, bound, cumulative))
+        lines.append('{0}_sum{{{1}}} {2}'.format(name, labels, self.sum))
+        lines.append('{0}_count{{{1}}} {2}'.format(name, labels, self.count))
+        return lines
+
+
+class MetricsRegistry:
+    """Метрики HTTP-запросов и запросов к базе данных по маршрутам"""
+
+    def __init__(self) -> None:
+        self.requests: defaultdict = defaultdict(int)
+        self.latency: defaultdict = defaultdict(lambda: Histogram(LATENCY_BUCKETS))
+        self.statements: defaultdict = defaultdict(lambda: Histogram(STATEMENT_BUCKETS))
+        self.db_seconds: defaultdict = defaultdict(float)
+
+    def observe(self, method: str, route: str, status: int, seconds: float, stats: QueryStats) -> None:
+        """Учесть завершённый HTTP-запрос"""
+        key = (method, route)
+        self.requests[(method, route, status)] += 1
+        self.latency[key].observe(seconds)
+        self.statements[key].observe(stats.statements)
+        self.db_seconds[key] += stats.seconds
+
+    def render(self) -> str:
+        """Все метрики в текстовом формате Prometheus"""
+        lines = [
+            '# HELP http_requests_total HTTP requests by route and status.',
+            '# TYPE http_requests_total counter',
+        ]
+        for (method, route, status), count in sorted(self.requests.items()):
+            lines.append('http_requests_total{{method="{0}",route="{1}",status="{2}"}} {3}'.format(method, route, status, count))
+        lines += [
+            '# HELP http_request_duration_seconds HTTP request latency by route.',
+            '# TYPE http_request_duration_seconds histogram',
+        ]
+        for (method, route), histogram in sorted(self.latency.items()):
+            lines += histogram.render('http_request_duration_seconds', 'method="{0}",route="{1}"'.format(method, route))
+        lines += [
+            '# HELP db_statements_per_request SQL statements issued per HTTP request.',
+            '# TYPE db_statements_per_request histogram',
+        ]
+        for (method, route), histogram in sorted(self.statements.items()):
+            lines += histogram.render('db_statements_per_request', 'method="{0}",route="{1}"'.format(method, route))
+        lines += [
+            '# HELP db_time_seconds_total Time spent executing SQL statements by route.',
+            '# TYPE db_time_seconds_total counter',
+        ]
+        for (method, route), seconds in sorted(self.db_seconds.items()):
+            lines.append('db_time_seconds_total{{method="{0}",route="{1}"}} {2}'.format(method, route, seconds))
+        replica = database.read_replica
+        if replica is not None:
+            lines += [
+                '# HELP db_replica_healthy Whether reads are routed to the replica.',
+                '# TYPE db_replica_healthy gauge',
+                'db_replica_healthy {0}'.format(int(replica.healthy)),
+                '# HELP db_replica_lag_seconds Replica replay lag at the last check.',
+                '# TYPE db_replica_lag_seconds gauge',
+                'db_replica_lag_seconds {0}'.format(replica.lag if replica.lag is not None else 'NaN'),
+            ]
+        return '\n'.join(lines) + '\n'
+
+
+registry = MetricsRegistry()
+
+
+class MetricsMiddleware:
+    """
+    ASGI-промежуточный слой: считает SQL-запросы и время ответа каждого
+    HTTP-запроса до отправки тела ответа (фоновые задачи не учитываются во времени).
+    При DEBUG=true добавляет заголовки X-DB-Queries и X-DB-Time-Ms.
+    """
+
+    def __init__(self, app) -> None:
+        self.app = app
+
+    async def __call__(self, scope, receive, send) -> None:
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+        stats = QueryStats()
+        token = query_stats.set(stats)
+        started = time.perf_counter()
+        finished = None
+        status = 500
+
+        async def send_with_stats(message) -> None:
+            nonlocal status, finished
+            if message['type'] == 'http.response.body' and not message.get('more_body', False):
+                finished = time.perf_counter()
+            if message['type'] == 'http.response.start':
+                status = message['status']
+                if DEBUG_HEADERS:
+                    message['headers'] = [
+                        *message.get('headers', []),
+                        (b'x-db-queries', str(stats.statements).encode()),
+                        (b'x-db-time-ms', '{0:.2f}'.format(stats.seconds * 1000).encode()),
+                    ]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_stats)
+        finally:
+            query_stats.reset(token)
+            route = scope.get('route')
+            registry.observe(
+                scope['method'],
+                getattr(route, 'path', 'unmatched'),
+                status,
+                (finished or time.perf_counter()) - started,
+                stats,
+            )
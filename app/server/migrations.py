@@ -0,0 +1,229 @@
+import asyncio
+import logging
+from typing import NamedTuple
+
+from database import engine
+from sqlalchemy import text
+from timeline import FANOUT_FOLLOWERS_LIMIT, TIMELINE_BACKFILL_LIMIT
+
+logger = logging.getLogger(__name__)
+
+MIGRATIONS_LOCK = 720301
+# Схема до введения миграций; заморожена, изменения схемы — только новыми миграциями
+BASE_SCHEMA = (
+    'CREATE TABLE IF NOT EXISTS users ('
+    'id serial PRIMARY KEY, name varchar NOT NULL UNIQUE, api_key varchar)',
+    'CREATE UNIQUE INDEX IF NOT EXISTS ix_users_api_key ON users (api_key)',
+    'CREATE TABLE IF NOT EXISTS tweets ('
+    'id serial PRIMARY KEY, user_id integer NOT NULL REFERENCES users (id), '
+    'content_data varchar NOT NULL, attachments integer[])',
+    'CREATE INDEX IF NOT EXISTS ix_tweets_user_id ON tweets (user_id)',
+    'CREATE TABLE IF NOT EXISTS likes ('
+    'tweet_id integer NOT NULL REFERENCES tweets (id), user_id integer NOT NULL REFERENCES users (id), '
+    'PRIMARY KEY (tweet_id, user_id))',
+    'CREATE TABLE IF NOT EXISTS medias ('
+    'id serial PRIMARY KEY, path_file varchar NOT NULL, user_id integer NOT NULL REFERENCES users (id))',
+    'CREATE TABLE IF NOT EXISTS followers ('
+    'follower_id integer NOT NULL REFERENCES users (id), followed_id integer NOT NULL REFERENCES users (id), '
+    'PRIMARY KEY (follower_id, followed_id))',
+)
+# Популярность твитов с весами по умолчанию на момент миграции 7 (см. ranking.py):
+# лайк 1, подписчик 0.1, период полураспада 24 часа. Смена весов — python counters.py
+SCORE_TWEETS_SQL = (
+    'UPDATE tweets SET score = '
+    'ln((1 + like_count + 0.1 * (SELECT followers_count FROM users WHERE users.id = tweets.user_id))::double precision) '
+    '+ extract(epoch FROM created_at)::double precision * ln(2) / 86400'
+)
+# Твиты каждого автора с номером от последнего, как в timeline.backfill_timelines
+LATEST_TWEETS_SQL = '(SELECT id, user_id, row_number() OVER (PARTITION BY user_id ORDER BY id DESC) AS position FROM tweets)'
+
+
+class Migration(NamedTuple):
+    """
+    Версия схемы базы данных.
+
+    Шаги — строки SQL или корутины, принимающие соединение. Нетранзакционные
+    миграции (например, CREATE INDEX CONCURRENTLY) выполняются в режиме
+    autocommit, поэтому их шаги должны быть идемпотентными.
+    """
+
+    version: int
+    description: str
+    steps: tuple
+    transactional: bool = True
+
+
+def index_concurrently(name, table, column, using='btree'):
+    """Шаг, создающий индекс без блокировки записи в таблицу"""
+    async def create_index(conn) -> None:
+        valid = await conn.execute(
+            text(
+                'SELECT i.indisvalid FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid '
+                'WHERE c.relname = :name AND c.relnamespace = current_schema()::regnamespace',
+            ),
+            {'name': name},
+        )
+        if valid.scalar() is False:
+            await conn.execute(text('DROP INDEX CONCURRENTLY IF EXISTS {0}'.format(name)))
+        await conn.execute(text(
+            'CREATE INDEX CONCURRENTLY IF NOT EXISTS {0} ON {1} USING {2} ({3})'.format(name, table, using, column),
+        ))
+    return create_index
+
+
+# Внешние ключи (таблица, столбец, ссылка), пересоздаваемые с ON DELETE CASCADE
+CASCADE_FOREIGN_KEYS = (
+    ('tweets', 'user_id', 'users'),
+    ('likes', 'tweet_id', 'tweets'),
+    ('likes', 'user_id', 'users'),
+    ('medias', 'user_id', 'users'),
+    ('followers', 'follower_id', 'users'),
+    ('followers', 'followed_id', 'users'),
+    ('timelines', 'user_id', 'users'),
+    ('timelines', 'tweet_id', 'tweets'),
+    ('timelines', 'author_id', 'users'),
+)
+
+
+def cascade_foreign_key(table, column, target):
+    """
+    Шаг, пересоздающий внешний ключ с ON DELETE CASCADE без проверки существующих строк.
+
+    Проверка NOT VALID ограничения выполняется отдельной миграцией
+    (validate_foreign_key), чтобы долгий проход по таблице не держал
+    блокировки этой транзакции.
+    """
+    name = '{0}_{1}_fkey'.format(table, column)
+    return (
+        'ALTER TABLE {0} DROP CONSTRAINT IF EXISTS {1}, ADD CONSTRAINT {1} FOREIGN KEY ({2}) '
+        'REFERENCES {3} ON DELETE CASCADE NOT VALID'.format(table, name, column, target)
+    )
+
+
+def validate_foreign_key(table, column, target):
+    """Шаг, проверяющий существующие строки для NOT VALID внешнего ключа"""
+    return 'ALTER TABLE {0} VALIDATE CONSTRAINT {0}_{1}_fkey'.format(table, column)
+
+
+MIGRATIONS = (
+    Migration(1, 'base schema', BASE_SCHEMA),
+    Migration(2, 'denormalized counters, timelines and media variants', (
+        'CREATE TABLE IF NOT EXISTS timelines ('
+        'user_id integer NOT NULL REFERENCES users (id), tweet_id integer NOT NULL REFERENCES tweets (id), '
+        'author_id integer NOT NULL REFERENCES users (id), PRIMARY KEY (user_id, tweet_id))',
+        'ALTER TABLE users ADD COLUMN IF NOT EXISTS followers_count integer NOT NULL DEFAULT 0',
+        'ALTER TABLE users ADD COLUMN IF NOT EXISTS following_count integer NOT NULL DEFAULT 0',
+        'ALTER TABLE tweets ADD COLUMN IF NOT EXISTS like_count integer NOT NULL DEFAULT 0',
+        'ALTER TABLE medias ADD COLUMN IF NOT EXISTS variants jsonb',
+        'UPDATE tweets SET like_count = (SELECT count(*) FROM likes WHERE likes.tweet_id = tweets.id)',
+        'UPDATE users SET '
+        'followers_count = (SELECT count(*) FROM followers WHERE followers.followed_id = users.id), '
+        'following_count = (SELECT count(*) FROM followers WHERE followers.follower_id = users.id)',
+        'INSERT INTO timelines (user_id, tweet_id, author_id) '
+        'SELECT recent.user_id, recent.id, recent.user_id FROM {0} recent '
+        'WHERE recent.position <= {1} ON CONFLICT DO NOTHING'.format(LATEST_TWEETS_SQL, TIMELINE_BACKFILL_LIMIT),
+        'INSERT INTO timelines (user_id, tweet_id, author_id) '
+        'SELECT followers.follower_id, recent.id, recent.user_id FROM followers '
+        'JOIN {0} recent ON recent.user_id = followers.followed_id AND recent.position <= {1} '
+        'JOIN users ON users.id = followers.followed_id '
+        'WHERE followers.follower_id <> followers.followed_id AND users.followers_count <= {2} '
+        'ON CONFLICT DO NOTHING'.format(LATEST_TWEETS_SQL, TIMELINE_BACKFILL_LIMIT, FANOUT_FOLLOWERS_LIMIT),
+    )),
+    Migration(3, 'hot-path indexes', (
+        index_concurrently('ix_likes_user_id', 'likes', 'user_id'),
+        index_concurrently('ix_followers_followed_id', 'followers', 'followed_id'),
+        index_concurrently('ix_medias_user_id', 'medias', 'user_id'),
+        index_concurrently('ix_timelines_tweet_id', 'timelines', 'tweet_id'),
+    ), transactional=False),
+    Migration(4, 'foreign key cascades', tuple(cascade_foreign_key(*key) for key in CASCADE_FOREIGN_KEYS)),
+    Migration(5, 'tweet search vector', (
+        "ALTER TABLE tweets ADD COLUMN IF NOT EXISTS search_vector tsvector "
+        "GENERATED ALWAYS AS (to_tsvector('simple', content_data)) STORED",
+    )),
+    Migration(6, 'tweet search index', (
+        index_concurrently('ix_tweets_search_vector', 'tweets', 'search_vector', using='gin'),
+    ), transactional=False),
+    Migration(7, 'tweet creation time and popularity score', (
+        'ALTER TABLE tweets ADD COLUMN IF NOT EXISTS created_at timestamptz NOT NULL DEFAULT now()',
+        'ALTER TABLE tweets ADD COLUMN IF NOT EXISTS score double precision NOT NULL DEFAULT 0',
+        SCORE_TWEETS_SQL,
+    )),
+    Migration(8, 'tweet popularity index', (
+        index_concurrently('ix_tweets_user_score', 'tweets', 'user_id, score, id'),
+    ), transactional=False),
+    Migration(9, 'timeline popularity score', (
+        'ALTER TABLE timelines ADD COLUMN IF NOT EXISTS score double precision NOT NULL DEFAULT 0',
+        'UPDATE timelines SET score = tweets.score FROM tweets WHERE tweets.id = timelines.tweet_id',
+    )),
+    Migration(10, 'timeline popularity index', (
+        index_concurrently('ix_timelines_user_score', 'timelines', 'user_id, score DESC, tweet_id DESC'),
+    ), transactional=False),
+    Migration(
+        11, 'validate foreign key cascades',
+        tuple(validate_foreign_key(*key) for key in CASCADE_FOREIGN_KEYS),
+        transactional=False,
+    ),
+    Migration(12, 'shared ETag versions', (
+        'CREATE TABLE IF NOT EXISTS cache_versions (key varchar PRIMARY KEY, version varchar NOT NULL)',
+    )),
+)
+
+
+async def run_steps(conn, migration) -> None:
+    """Выполнить шаги миграции и записать её версию"""
+    for step in migration.steps:
+        if callable(step):
+            await step(conn)
+        else:
+            await conn.execute(text(step))
+    await conn.execute(
+        text('INSERT INTO schema_migrations (version, description) VALUES (:version, :description)'),
+        {'version': migration.version, 'description': migration.description},
+    )
+
+
+async def migrate(target_engine=engine):
+    """
+    Применить недостающие миграции по порядку версий.
+
+    Одновременный запуск из нескольких процессов сериализуется
+    advisory-блокировкой.
+
+    Returns:
+        list: Версии, применённые при этом запуске
+    """
+    applied = []
+    async with target_engine.connect() as lock_conn:
+        lock_conn = await lock_conn.execution_options(isolation_level='AUTOCOMMIT')
+        await lock_conn.execute(text('SELECT pg_advisory_lock(:key)'), {'key': MIGRATIONS_LOCK})
+        try:
+            await lock_conn.execute(text(
+                'CREATE TABLE IF NOT EXISTS schema_migrations ('
+                'version integer PRIMARY KEY, description text NOT NULL, '
+                'applied_at timestamptz NOT NULL DEFAULT now())',
+            ))
+            versions = await lock_conn.execute(text('SELECT version FROM schema_migrations'))
+            done = set(versions.scalars())
+            for migration in MIGRATIONS:
+                if migration.version in done:
+                    continue
+                logger.info('Миграция %s: %s', migration.version, migration.description)
+                if migration.transactional:
+                    async with target_engine.begin() as conn:
+                        await run_steps(conn, migration)
+                else:
+                    await run_steps(lock_conn, migration)
+                applied.append(migration.version)
+        finally:
+            await lock_conn.execute(text('SELECT pg_advisory_unlock(:key)'), {'key': MIGRATIONS_LOCK})
+    return applied
+
+
+async def main() -> None:
+    """Обновление схемы базы данных до последней версии"""
+    logging.basicConfig(level=logging.INFO)
+    await migrate()
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
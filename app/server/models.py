@@ -1,5 +1,6 @@
-from sqlalchemy import ARRAY, Column, ForeignKey, Integer, String
-from sqlalchemy.orm import DeclarativeBase, declarative_base, relationship
+from sqlalchemy import ARRAY, Column, Computed, DateTime, Float, ForeignKey, Index, Integer, String, func, text
+from sqlalchemy.dialects.postgresql import JSONB, TSVECTOR
+from sqlalchemy.orm import DeclarativeBase, declarative_base, deferred, relationship
 
 Base: DeclarativeBase = declarative_base()
 
@@ -12,6 +13,8 @@ class User(Base):
     id: int = Column(Integer, primary_key=True)
     name: str = Column(String, nullable=False, unique=True)
     api_key: str = Column(String, unique=True, index=True)
+    followers_count: int = Column(Integer, nullable=False, default=0, server_default='0')
+    following_count: int = Column(Integer, nullable=False, default=0, server_default='0')
     tweets = relationship('Tweet', back_populates='user')
     likes = relationship('Like', back_populates='user')
 
@@ -33,13 +36,21 @@ class Tweet(Base):
     """Модель твит"""
 
     __tablename__ = 'tweets'
-    __table_args__ = {'extend_existing': True}
+    __table_args__ = (
+        Index('ix_tweets_search_vector', 'search_vector', postgresql_using='gin'),
+        Index('ix_tweets_user_score', 'user_id', 'score', 'id'),
+        {'extend_existing': True},
+    )
     id: int = Column(Integer, primary_key=True)
-    user_id: int = Column(Integer, ForeignKey('users.id'), nullable=False, index=True)
+    user_id: int = Column(Integer, ForeignKey('users.id', ondelete='CASCADE'), nullable=False, index=True)
     content_data: str = Column(String, nullable=False)
     attachments = Column(ARRAY(Integer))
+    like_count: int = Column(Integer, nullable=False, default=0, server_default='0')
+    created_at = Column(DateTime(timezone=True), nullable=False, server_default=func.now())
+    score: float = Column(Float, nullable=False, default=0, server_default=text('0'))
+    search_vector = deferred(Column(TSVECTOR, Computed("to_tsvector('simple', content_data)", persisted=True)))
     user = relationship('User', back_populates='tweets', lazy='joined')
-    likes = relationship('Like', back_populates='tweet', lazy='select', cascade='all, delete-orphan')
+    likes = relationship('Like', back_populates='tweet', lazy='select', cascade='all, delete-orphan', passive_deletes=True)
 
 
 class Like(Base):
@@ -47,8 +58,8 @@ class Like(Base):
 
     __tablename__ = 'likes'
     __table_args__ = {'extend_existing': True}
-    tweet_id: int = Column(Integer, ForeignKey('tweets.id'), nullable=False, primary_key=True)
-    user_id: int = Column(Integer, ForeignKey('users.id'), nullable=False, primary_key=True)
+    tweet_id: int = Column(Integer, ForeignKey('tweets.id', ondelete='CASCADE'), nullable=False, primary_key=True)
+    user_id: int = Column(Integer, ForeignKey('users.id', ondelete='CASCADE'), nullable=False, primary_key=True, index=True)
     tweet = relationship('Tweet', back_populates='likes')
     user = relationship('User', back_populates='likes')
 
@@ -60,7 +71,8 @@ class Media(Base):
     __table_args__ = {'extend_existing': True}
     id: int = Column(Integer, primary_key=True)
     path_file: str = Column(String, nullable=False)
-    user_id: int = Column(Integer, ForeignKey('users.id'), nullable=False)
+    user_id: int = Column(Integer, ForeignKey('users.id', ondelete='CASCADE'), nullable=False, index=True)
+    variants = Column(JSONB)
 
 
 class Follow(Base):
@@ -68,7 +80,30 @@ class Follow(Base):
 
     __tablename__ = 'followers'
     __table_args__ = {'extend_existing': True}
-    follower_id: int = Column(Integer, ForeignKey('users.id'), primary_key=True)
-    followed_id: int = Column(Integer, ForeignKey('users.id'), primary_key=True)
+    follower_id: int = Column(Integer, ForeignKey('users.id', ondelete='CASCADE'), primary_key=True)
+    followed_id: int = Column(Integer, ForeignKey('users.id', ondelete='CASCADE'), primary_key=True, index=True)
     follower = relationship('User', foreign_keys=[follower_id])
-    followed = relationship('User', foreign_keys=[followed_id])
\ No newline at end of file
+    followed = relationship('User', foreign_keys=[followed_id])
+
+
+class Timeline(Base):
+    """Модель ленты подписчика"""
+
+    __tablename__ = 'timelines'
+    __table_args__ = {'extend_existing': True}
+    user_id: int = Column(Integer, ForeignKey('users.id', ondelete='CASCADE'), primary_key=True)
+    tweet_id: int = Column(Integer, ForeignKey('tweets.id', ondelete='CASCADE'), primary_key=True, index=True)
+    author_id: int = Column(Integer, ForeignKey('users.id', ondelete='CASCADE'), nullable=False)
+    score: float = Column(Float, nullable=False, default=0, server_default=text('0'))
+
+
+Index('ix_timelines_user_score', Timeline.user_id, Timeline.score.desc(), Timeline.tweet_id.desc())
+
+
+class CacheVersion(Base):
+    """Модель версии ресурса для ETag, общей для процессов сервера"""
+
+    __tablename__ = 'cache_versions'
+    __table_args__ = {'extend_existing': True}
+    key: str = Column(String, primary_key=True)
+    version: str = Column(String, nullable=False)
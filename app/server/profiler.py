@@ -0,0 +1,262 @@
+import asyncio
+import itertools
+import os
+import random
+import secrets
+import sys
+import threading
+import time
+import weakref
+from collections import Counter, deque
+from contextvars import ContextVar
+from typing import Optional
+
+from database import query_stats
+from fastapi import APIRouter, Header, HTTPException
+from fastapi.responses import PlainTextResponse
+
+PROFILER_TOKEN = os.getenv('PROFILER_TOKEN', '')
+PROFILER_INTERVAL = float(os.getenv('PROFILER_INTERVAL', '0.001'))
+PROFILER_SAMPLE_RATE = float(os.getenv('PROFILER_SAMPLE_RATE', '0'))
+PROFILER_SLOW_MS = float(os.getenv('PROFILER_SLOW_MS', '500'))
+PROFILER_KEEP = int(os.getenv('PROFILER_KEEP', '20'))
+
+AWAIT_FRAME = '[await]'
+IDLE_FRAME = '[idle]'
+OTHER_FRAME = '[other tasks]'
+
+_ids = itertools.count(1)
+# Профиль запроса, в контексте которого создаются задачи, например отдача тела StreamingResponse
+current_profile: ContextVar = ContextVar('current_profile', default=None)
+# Задачи профилируемых запросов: задача самого запроса и порождённые ею
+task_profiles: weakref.WeakKeyDictionary = weakref.WeakKeyDictionary()
+
+
+class Profile:
+    """Профиль одного HTTP-запроса: стеки вызовов и доли ожидания, простоя и работы других задач"""
+
+    def __init__(self, method: str, path: str, stats, reason: str) -> None:
+        self.id = next(_ids)
+        self.method = method
+        self.path = path
+        self.stats = stats
+        self.reason = reason
+        self.stacks: Counter = Counter()
+        self.started = time.perf_counter()
+        self.wall_seconds = 0.0
+        self.db_seconds = 0.0
+        self.statements = 0
+
+    def summary(self) -> dict:
+        """Краткие сведения о профиле"""
+        samples = sum(self.stacks.values())
+        own = samples - self.stacks[(AWAIT_FRAME,)] - self.stacks[(IDLE_FRAME,)] - self.stacks[(OTHER_FRAME,)]
+        return {
+            'id': self.id,
+            'method': self.method,
+            'path': self.path,
+            'reason': self.reason,
+            'wall_ms': round(self.wall_seconds * 1000, 2),
+            'cpu_ms': round(own * PROFILER_INTERVAL * 1000, 2),
+            'await_ms': round(self.stacks[(AWAIT_FRAME,)] * PROFILER_INTERVAL * 1000, 2),
+            'idle_ms': round(self.stacks[(IDLE_FRAME,)] * PROFILER_INTERVAL * 1000, 2),
+            'db_ms': round(self.db_seconds * 1000, 2),
+            'statements': self.statements,
+            'samples': samples,
+        }
+
+    def folded(self) -> str:
+        """Стеки в свёрнутом формате flamegraph.pl / speedscope: «кадр;кадр;кадр число»"""
+        root = '{0} {1}'.format(self.method, self.path)
+        return ''.join(
+            '{0};{1} {2}\n'.format(root, ';'.join(stack), count)
+            for stack, count in sorted(self.stacks.items())
+        )
+
+
+def frame_stack(frame) -> tuple:
+    """Стек вызовов от корня к текущему кадру"""
+    stack = []
+    while frame is not None:
+        stack.append('{0}:{1}'.format(os.path.basename(frame.f_code.co_filename), frame.f_code.co_name))
+        frame = frame.f_back
+    return tuple(reversed(stack))
+
+
+def install_task_factory(loop) -> None:
+    """Относить задачи, созданные в контексте профилируемого запроса, к его профилю"""
+    previous = loop.get_task_factory()
+    if getattr(previous, 'profiled', False):
+        return
+
+    def task_factory(loop, coro, context=None):
+        if previous is not None:
+            task = previous(loop, coro) if context is None else previous(loop, coro, context=context)
+        else:
+            task = asyncio.Task(coro, loop=loop, context=context)
+        profile = current_profile.get() if context is None else context.get(current_profile)
+        if profile is not None:
+            task_profiles[task] = profile
+        return task
+
+    task_factory.profiled = True
+    loop.set_task_factory(task_factory)
+
+
+class Sampler:
+    """
+    Поток, который с интервалом PROFILER_INTERVAL снимает стек потока цикла
+    событий. Сэмпл относится к профилируемому запросу, если в этот момент
+    выполняется его задача или порождённая ею (по task_profiles). Если цикл событий простаивает, пока выполняется SQL-запрос
+    запроса, — это ожидание базы данных [await], иначе простой [idle];
+    в остальное время работают другие задачи.
+    """
+
+    def __init__(self) -> None:
+        self.profiles: dict = {}
+        self.lock = threading.Lock()
+        self.thread: Optional[threading.Thread] = None
+        self.loop = None
+        self.loop_thread_id = None
+
+    def add(self, profile: Profile) -> None:
+        """Начать сбор сэмплов для запроса"""
+        install_task_factory(asyncio.get_running_loop())
+        with self.lock:
+            self.profiles[profile.id] = profile
+            if self.thread is None:
+                self.loop = asyncio.get_running_loop()
+                self.loop_thread_id = threading.get_ident()
+                self.thread = threading.Thread(target=self.run, name='profiler', daemon=True)
+                self.thread.start()
+
+    def remove(self, profile: Profile) -> None:
+        """Закончить сбор сэмплов для запроса"""
+        with self.lock:
+            self.profiles.pop(profile.id, None)
+
+    def run(self) -> None:
+        """Снимать сэмплы, пока есть профилируемые запросы"""
+        while True:
+            time.sleep(PROFILER_INTERVAL)
+            with self.lock:
+                if not self.profiles:
+                    self.thread = None
+                    return
+                profiles = list(self.profiles.values())
+            frame = sys._current_frames().get(self.loop_thread_id)
+            task = asyncio.current_task(self.loop)
+            owner = task_profiles.get(task) if task is not None else None
+            for profile in profiles:
+                if owner is profile:
+                    profile.stacks[frame_stack(frame)] += 1
+                elif task is not None:
+                    profile.stacks[(OTHER_FRAME,)] += 1
+                elif profile.stats is not None and profile.stats.active > 0:
+                    profile.stacks[(AWAIT_FRAME,)] += 1
+                else:
+                    profile.stacks[(IDLE_FRAME,)] += 1
+
+
+sampler = Sampler()
+profiles: deque = deque(maxlen=PROFILER_KEEP)
+
+
+def profile_reason(headers) -> Optional[str]:
+    """Причина профилировать запрос: авторизованный заголовок или случайная выборка"""
+    token = dict(headers).get(b'x-profile')
+    if PROFILER_TOKEN and token is not None and secrets.compare_digest(token.decode(), PROFILER_TOKEN):
+        return 'header'
+    if PROFILER_SAMPLE_RATE and random.random() < PROFILER_SAMPLE_RATE:
+        return 'sampled'
+    return None
+
+
+class ProfilerMiddleware:
+    """
+    ASGI-промежуточный слой профилирования запросов.
+
+    Запрос профилируется, если в нём есть заголовок X-Profile с токеном
+    PROFILER_TOKEN, либо с вероятностью PROFILER_SAMPLE_RATE; во втором случае
+    профиль сохраняется, только если запрос выполнялся дольше PROFILER_SLOW_MS.
+    Сэмплы собираются до отправки последней части тела ответа, в том числе
+    из задачи, отдающей тело StreamingResponse. Хранятся последние
+    PROFILER_KEEP профилей.
+    """
+
+    def __init__(self, app) -> None:
+        self.app = app
+
+    async def __call__(self, scope, receive, send) -> None:
+        reason = profile_reason(scope.get('headers', [])) if scope['type'] == 'http' else None
+        if reason is None:
+            await self.app(scope, receive, send)
+            return
+        stats = query_stats.get()
+        profile = Profile(scope['method'], scope['path'], stats, reason)
+        statements, db_seconds = (stats.statements, stats.seconds) if stats else (0, 0.0)
+
+        async def send_profiled(message) -> None:
+            await send(message)
+            if message['type'] == 'http.response.body' and not message.get('more_body', False):
+                sampler.remove(profile)
+
+        task = asyncio.current_task()
+        task_profiles[task] = profile
+        token = current_profile.set(profile)
+        sampler.add(profile)
+        try:
+            await self.app(scope, receive, send_profiled)
+        finally:
+            sampler.remove(profile)
+            current_profile.reset(token)
+            task_profiles.pop(task, None)
+            profile.wall_seconds = time.perf_counter() - profile.started
+            if stats is not None:
+                profile.statements = stats.statements - statements
+                profile.db_seconds = stats.seconds - db_seconds
+            if reason == 'header' or profile.wall_seconds * 1000 >= PROFILER_SLOW_MS:
+                profiles.append(profile)
+
+
+def check_admin_token(token: Optional[str]) -> None:
+    """Доступ к профилям только с токеном PROFILER_TOKEN"""
+    if not PROFILER_TOKEN or token is None or not secrets.compare_digest(token, PROFILER_TOKEN):
+        raise HTTPException(status_code=403, detail='Access denied')
+
+
+admin_router = APIRouter()
+
+
+@admin_router.get('/admin/profiles', include_in_schema=False)
+async def list_profiles(admin_token: Optional[str] = Header(default=None, alias='x-profile')):
+    """
+    Последние сохранённые профили
+
+    Parameters:
+        admin_token (str): токен PROFILER_TOKEN в заголовке X-Profile
+
+    Returns:
+        dict: Сводка по каждому профилю, новые первыми
+    """
+    check_admin_token(admin_token)
+    return {'result': True, 'profiles': [profile.summary() for profile in reversed(profiles)]}
+
+
+@admin_router.get('/admin/profiles/{profile_id}', include_in_schema=False)
+async def get_profile(profile_id: int, admin_token: Optional[str] = Header(default=None, alias='x-profile')):
+    """
+    Профиль в свёрнутом формате стеков для flamegraph.pl или speedscope
+
+    Parameters:
+        profile_id (int): идентификатор профиля
+        admin_token (str): токен PROFILER_TOKEN в заголовке X-Profile
+
+    Returns:
+        PlainTextResponse: Строки «кадр;кадр;кадр число»
+    """
+    check_admin_token(admin_token)
+    for profile in profiles:
+        if profile.id == profile_id:
+            return PlainTextResponse(profile.folded())
+    raise HTTPException(status_code=404, detail='No profile with this id')
@@ -0,0 +1,84 @@
+"""
+Популярность твитов с затуханием по времени.
+
+Популярность твита
+    (1 + RANK_LIKE_WEIGHT * лайки + RANK_FOLLOWER_WEIGHT * подписчики автора) * 2 ** (-возраст / период полураспада)
+упорядочивает твиты так же, как её логарифм
+    ln(1 + ...) + ln 2 * время создания / период полураспада,
+который не зависит от текущего момента. Логарифм хранится в tweets.score
+и копируется в timelines.score: его не нужно пересчитывать со временем,
+только при изменении лайков твита или числа подписчиков автора, и по нему
+работают индексы ленты.
+Через RANK_HALF_LIFE_HOURS твит с тем же числом лайков опускается
+так же, как если бы его популярность уменьшилась вдвое.
+"""
+import math
+import os
+from datetime import timedelta
+
+from models import Timeline, Tweet, User
+from sqlalchemy import ARRAY, Float, Integer, any_, bindparam, cast, func, update
+from sqlalchemy.future import select
+
+RANK_LIKE_WEIGHT = float(os.getenv('RANK_LIKE_WEIGHT', '1'))
+RANK_FOLLOWER_WEIGHT = float(os.getenv('RANK_FOLLOWER_WEIGHT', '0.1'))
+RANK_HALF_LIFE_HOURS = float(os.getenv('RANK_HALF_LIFE_HOURS', '24'))
+RANK_REFRESH_DAYS = int(os.getenv('RANK_REFRESH_DAYS', '7'))
+
+DECAY_PER_SECOND = math.log(2) / (RANK_HALF_LIFE_HOURS * 3600)
+
+
+def score_expression(like_count, followers_count, created_at):
+    """SQL-выражение логарифма популярности"""
+    popularity = 1 + RANK_LIKE_WEIGHT * like_count + RANK_FOLLOWER_WEIGHT * followers_count
+    return func.ln(cast(popularity, Float)) + cast(func.extract('epoch', created_at), Float) * DECAY_PER_SECOND
+
+
+def author_followers(user_id=Tweet.user_id):
+    """Число подписчиков автора подзапросом"""
+    return select(User.followers_count).where(User.id == user_id).scalar_subquery()
+
+
+def tweet_score(like_count=Tweet.like_count):
+    """Популярность существующего твита для UPDATE tweets"""
+    return score_expression(like_count, author_followers(), Tweet.created_at)
+
+
+def new_tweet_score(user_id):
+    """Популярность нового твита пользователя для INSERT"""
+    return score_expression(0, author_followers(user_id), func.now())
+
+
+async def sync_timeline_scores(session, *conditions):
+    """Скопировать популярность твитов, отобранных условиями на Tweet, в ленты подписчиков"""
+    await session.execute(
+        update(Timeline).where(Timeline.tweet_id == Tweet.id, *conditions).values(score=Tweet.score),
+    )
+
+
+async def refresh_tweet_scores(session, tweet_ids):
+    """Пересчитать популярность твитов после изменения числа лайков"""
+    changed = Tweet.id == any_(bindparam('tweet_ids', list(tweet_ids), type_=ARRAY(Integer)))
+    await session.execute(update(Tweet).where(changed).values(score=tweet_score()))
+    await sync_timeline_scores(session, changed)
+
+
+async def refresh_author_scores(session, author_ids):
+    """
+    Пересчитать популярность недавних твитов авторов после изменения числа подписчиков.
+
+    Твиты старше RANK_REFRESH_DAYS не пересчитываются: их вклад уже
+    уменьшился в 2 ** (RANK_REFRESH_DAYS * 24 / RANK_HALF_LIFE_HOURS) раз.
+    """
+    recent = (
+        Tweet.user_id == any_(bindparam('author_ids', list(author_ids), type_=ARRAY(Integer))),
+        Tweet.created_at > func.now() - timedelta(days=RANK_REFRESH_DAYS),
+    )
+    await session.execute(update(Tweet).where(*recent).values(score=tweet_score()))
+    await sync_timeline_scores(session, *recent)
+
+
+async def rescore_tweets(session):
+    """Пересчитать популярность всех твитов, например после смены весов"""
+    await session.execute(update(Tweet).values(score=tweet_score()))
+    await sync_timeline_scores(session)
@@ -0,0 +1,95 @@
+import asyncio
+import logging
+import os
+
+from cache import invalidate_feeds
+from counters import tweet_authors
+from database import async_session
+from ranking import refresh_author_scores, refresh_tweet_scores
+
+logger = logging.getLogger(__name__)
+
+RANK_REFRESH_INTERVAL = float(os.getenv('RANK_REFRESH_INTERVAL', '5'))
+
+
+class ScoreRefresher:
+    """
+    Отложенный пересчёт популярности твитов.
+
+    Лайки и подписки меняют только счётчики и отмечают твиты и авторов,
+    а популярность в tweets.score и копиях твитов в лентах пересчитывается
+    пачкой раз в interval секунд и при остановке приложения. Повторные
+    изменения одного твита или автора за интервал дают один пересчёт.
+
+    Отметки свои у каждого процесса и теряются при его падении;
+    разошедшуюся популярность восстанавливает python counters.py.
+    """
+
+    def __init__(self, interval: float) -> None:
+        self.interval = interval
+        self._tweet_ids: set = set()
+        self._author_ids: set = set()
+        self._lock = asyncio.Lock()
+        self._wakeup = None
+        self._task = None
+
+    def mark_tweets(self, tweet_ids):
+        """Отметить твиты, у которых изменилось число лайков"""
+        self._tweet_ids.update(tweet_ids)
+
+    def mark_authors(self, author_ids):
+        """Отметить авторов, у которых изменилось число подписчиков"""
+        self._author_ids.update(author_ids)
+
+    async def flush(self):
+        """
+        Пересчитать популярность отмеченных твитов и авторов одной транзакцией.
+
+        Returns:
+            int: Количество пересчитанных твитов и авторов
+        """
+        async with self._lock:
+            if not self._tweet_ids and not self._author_ids:
+                return 0
+            tweet_ids, self._tweet_ids = self._tweet_ids, set()
+            author_ids, self._author_ids = self._author_ids, set()
+            try:
+                async with async_session() as session:
+                    if tweet_ids:
+                        await refresh_tweet_scores(session, tweet_ids)
+                    if author_ids:
+                        await refresh_author_scores(session, author_ids)
+                    authors = await tweet_authors(session, tweet_ids)
+                    await session.commit()
+            except Exception:
+                logger.exception('Не удалось пересчитать популярность %s твитов', len(tweet_ids))
+                self._tweet_ids |= tweet_ids
+                self._author_ids |= author_ids
+                return 0
+        invalidate_feeds(author_ids={*authors, *author_ids})
+        return len(tweet_ids) + len(author_ids)
+
+    async def run(self):
+        """Периодический пересчёт до вызова stop"""
+        while self._task is not None:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.interval)
+            except asyncio.TimeoutError:
+                pass
+            await self.flush()
+
+    def start(self):
+        """Запустить фоновый пересчёт"""
+        self._wakeup = asyncio.Event()
+        self._task = asyncio.create_task(self.run())
+
+    async def stop(self):
+        """Остановить фоновый пересчёт и пересчитать оставшиеся отметки"""
+        task, self._task = self._task, None
+        if task is not None:
+            self._wakeup.set()
+            await task
+        await self.flush()
+
+
+score_refresher = ScoreRefresher(RANK_REFRESH_INTERVAL)
@@ -1,43 +1,106 @@
-import aiofiles
-from database import session
-from fastapi import APIRouter, File, Header, HTTPException, UploadFile
-from models import Follow, Like, Media, Tweet, User
-from schemas import TweetSchema
-from sqlalchemy import delete
+from typing import Optional
+
+from cache import feed_versions, invalidate_feeds, invalidate_profiles, profile_version, timeline_version
+from counters import add_follow, add_follows, add_like, add_likes, int_array, remove_follow, remove_like, tweet_authors
+from database import get_session, session_for_version
+from etags import (
+    FEED_CACHE_CONTROL,
+    ME_CACHE_CONTROL,
+    PROFILE_CACHE_CONTROL,
+    etag_matches,
+    make_etag,
+    make_multi_etag,
+    not_modified,
+)
+from events import broadcast, event_broker, publish_likes, publish_tweets, stream_events
+from feed import FEED_MAX_PAGE_SIZE, FEED_PAGE_SIZE, decode_cursor, feed_authors, get_feed, search_tweets, stream_feed
+from fastapi import APIRouter, BackgroundTasks, Depends, File, Header, HTTPException, Query, Response, UploadFile
+from fastapi.responses import StreamingResponse
+from likes_buffer import like_buffer
+from media import MEDIA_VARIANTS, MediaTooLargeError, store_upload
+from models import Media, Tweet, User
+from ranking import new_tweet_score
+from rescoring import score_refresher
+from schemas import (
+    FeedSchema,
+    FollowBatchResultSchema,
+    FollowBatchSchema,
+    LikesBatchResultSchema,
+    LikesBatchSchema,
+    MediaCreatedSchema,
+    ProfileSchema,
+    ResultSchema,
+    TweetCreatedSchema,
+    TweetSchema,
+    TweetsBatchResultSchema,
+    TweetsBatchSchema,
+)
+from sqlalchemy import any_, delete, insert
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.future import select
-from utlis import get_tweets_info, get_tweets_sort, get_user, get_users_info
+from thumbnails import generate_variants
+from timeline import (
+    backfill_timeline,
+    backfill_timelines,
+    fan_out_tweet,
+    fan_out_tweets,
+    prune_timeline_author,
+)
+from utlis import PROFILE_MAX_PAGE_SIZE, get_user, get_users_info, user_exists
 
 router = APIRouter()
 
 
-@router.get(path='/users/me')
-async def get_profile_my(api_key: str = Header(default=..., alias='api-key')):
+@router.get(path='/users/me', response_model=ProfileSchema)
+async def get_profile_my(
+    response: Response,
+    api_key: str = Header(default=..., alias='api-key'),
+    limit: Optional[int] = Query(default=None, ge=1, le=PROFILE_MAX_PAGE_SIZE),
+    followers_after: Optional[int] = None,
+    following_after: Optional[int] = None,
+    if_none_match: Optional[str] = Header(default=None, alias='if-none-match'),
+    session: AsyncSession = Depends(get_session),
+):
     """
      Получите информацию обо мне
 
     Parameters:
         api_key (str): ключ API, используемый для идентификации пользователя
+        limit (int): размер страницы списков подписчиков и подписок
+        followers_after (int): идентификатор последнего подписчика предыдущей страницы
+        following_after (int): идентификатор последней подписки предыдущей страницы
+        if_none_match (str): ETag ранее полученного ответа
 
     Returns:
-        dict:  Информация обо мне
+        dict:  Информация обо мне или ответ 304, если профиль не изменился
 
     Raises:
         HTTPException:  Если пользователя нет в базе данных
     """
 
 
-    result_user = await get_user(api_key)
+    result_user = await get_user(session, api_key)
     if result_user:
-        user_model = await get_users_info(result_user.id, result_user.name)
+        etag = make_etag(profile_version(result_user.id), 'me', limit, followers_after, following_after)
+        if etag_matches(if_none_match, etag):
+            return not_modified(etag, ME_CACHE_CONTROL)
+        async with session_for_version(session, profile_version(result_user.id)) as read_session:
+            user_model = await get_users_info(read_session, result_user.id, limit, followers_after, following_after)
+        response.headers['ETag'] = etag
+        response.headers['Cache-Control'] = ME_CACHE_CONTROL
         return {
             'result': True,
-            'user': user_model.model_dump(),
+            'user': user_model,
         }
     raise HTTPException(status_code=400, detail='No user with this api-key')
 
 
-@router.post(path='/tweets')
-async def tweet_post(tweet_data: TweetSchema, api_key: str = Header(default=..., alias='api-key')):
+@router.post(path='/tweets', response_model=TweetCreatedSchema)
+async def tweet_post(
+    tweet_data: TweetSchema,
+    api_key: str = Header(default=..., alias='api-key'),
+    session: AsyncSession = Depends(get_session),
+):
     """
     Add post.
 
@@ -50,13 +113,22 @@ async def tweet_post(tweet_data: TweetSchema, api_key: str = Header(default=...,
     Raises:
         HTTPException: Если ошибка в tweet_data
     """
-    user = await get_user(api_key)
+    user = await get_user(session, api_key)
     if user:
         user_id = user.id
-        tweet_model = Tweet(content_data=tweet_data.tweet_data, attachments=tweet_data.tweet_media_ids, user_id=user_id)
+        tweet_model = Tweet(
+            content_data=tweet_data.tweet_data,
+            attachments=tweet_data.tweet_media_ids,
+            user_id=user_id,
+            score=new_tweet_score(user_id),
+        )
         session.add(tweet_model)
+        await session.flush()
+        await fan_out_tweet(session, tweet_model)
         await session.commit()
+        invalidate_feeds(author_ids=[user_id])
         await session.refresh(tweet_model)
+        await publish_tweets(session, user, [tweet_model])
         return {
             'result': True,
             'tweet_id': tweet_model.id,
@@ -64,29 +136,85 @@ async def tweet_post(tweet_data: TweetSchema, api_key: str = Header(default=...,
     raise HTTPException(status_code=400, detail='Access denied')
 
 
-@router.post(path='/medias')
-async def tweet_media(file_media: UploadFile = File(...), api_key: str = Header(default=..., alias='api-key')):
+@router.post(path='/tweets:batch', response_model=TweetsBatchResultSchema)
+async def tweet_post_batch(
+    tweets_data: TweetsBatchSchema,
+    api_key: str = Header(default=..., alias='api-key'),
+    session: AsyncSession = Depends(get_session),
+):
+    """
+    Добавить несколько твитов в одной транзакции
+
+    Parameters:
+        tweets_data (TweetsBatchSchema): твиты, не более BATCH_MAX_ITEMS
+        api_key (str): Ключ API, используемый для идентификации пользователя
+
+    Returns:
+        dict:  Результат для каждого твита в порядке запроса
+
+    Raises:
+        HTTPException: Если пользователя нет в базе данных
+    """
+    user = await get_user(session, api_key)
+    if not user:
+        raise HTTPException(status_code=400, detail='Access denied')
+    inserted = await session.execute(
+        insert(Tweet).values(score=new_tweet_score(user.id)).returning(Tweet.id, sort_by_parameter_order=True),
+        [
+            {'user_id': user.id, 'content_data': tweet.tweet_data, 'attachments': tweet.tweet_media_ids}
+            for tweet in tweets_data.tweets
+        ],
+    )
+    tweet_ids = inserted.scalars().all()
+    await fan_out_tweets(session, user.id, tweet_ids)
+    await session.commit()
+    invalidate_feeds(author_ids=[user.id])
+    await publish_tweets(session, user, [
+        Tweet(id=tweet_id, content_data=tweet.tweet_data, attachments=tweet.tweet_media_ids)
+        for tweet_id, tweet in zip(tweet_ids, tweets_data.tweets)
+    ])
+    return {
+        'result': True,
+        'results': [{'result': True, 'tweet_id': tweet_id} for tweet_id in tweet_ids],
+    }
+
+
+@router.post(path='/medias', response_model=MediaCreatedSchema)
+async def tweet_media(
+    background_tasks: BackgroundTasks,
+    file_media: UploadFile = File(...),
+    api_key: str = Header(default=..., alias='api-key'),
+    session: AsyncSession = Depends(get_session),
+):
     """
     Добавить медиа
 
+    Уменьшенные варианты изображения строятся в фоне после отправки ответа.
+
     Parameters:
         file_media (UploadFile): Файл медиа
         api_key (str): ключ API, используемый для идентификации пользователя.
 
     Returns:
         dict: Информация об успехе
+
+    Raises:
+        HTTPException: Если пользователя нет в базе данных или файл слишком большой
     """
 
 
-    user = await get_user(api_key)
-    filelocation = './images/{file}'.format(file=file_media.filename)
-    async with aiofiles.open(filelocation, 'wb') as outfile:
-        content_media = await file_media.read()
-        await outfile.write(content_media)
+    user = await get_user(session, api_key)
+    if not user:
+        raise HTTPException(status_code=400, detail='Access denied')
+    try:
+        filelocation = await store_upload(file_media)
+    except MediaTooLargeError:
+        raise HTTPException(status_code=413, detail='File is too large')
     media_model = Media(path_file=filelocation, user_id=user.id)
     session.add(media_model)
     await session.commit()
     await session.refresh(media_model)
+    background_tasks.add_task(generate_variants, media_model.id, filelocation)
 
     return {
         'result': True,
@@ -94,8 +222,12 @@ async def tweet_media(file_media: UploadFile = File(...), api_key: str = Header(
     }
 
 
-@router.delete(path='/tweets/{id_tweet}')
-async def tweet_delete(id_tweet, api_key: str = Header(default=..., alias='api-key')):
+@router.delete(path='/tweets/{id_tweet}', response_model=ResultSchema)
+async def tweet_delete(
+    id_tweet,
+    api_key: str = Header(default=..., alias='api-key'),
+    session: AsyncSession = Depends(get_session),
+):
     """
     Удалить свой твит
 
@@ -109,21 +241,25 @@ async def tweet_delete(id_tweet, api_key: str = Header(default=..., alias='api-k
     """
 
 
-    user = await get_user(api_key)
-    tweet_deleting = await session.execute(select(Tweet).where(
+    user = await get_user(session, api_key)
+    tweet_deleting = await session.execute(delete(Tweet).where(
         Tweet.id == int(id_tweet), Tweet.user_id == user.id,
-    ),
+    ).returning(Tweet.id),
     )
-    tweet_to_delete = tweet_deleting.scalar()
-    if tweet_to_delete:
-        await session.delete(tweet_to_delete)
+    if tweet_deleting.first():
         await session.commit()
+        invalidate_feeds(author_ids=[user.id])
+        broadcast('tweet_deleted', {'tweet_id': int(id_tweet)})
         return {'result': True}
     raise HTTPException(status_code=404, detail='No tweet with this id')
 
 
-@router.post(path='/tweets/{id_tweet}/likes')
-async def tweet_like(id_tweet, api_key: str = Header(default=..., alias='api-key')):
+@router.post(path='/tweets/{id_tweet}/likes', response_model=ResultSchema)
+async def tweet_like(
+    id_tweet,
+    api_key: str = Header(default=..., alias='api-key'),
+    session: AsyncSession = Depends(get_session),
+):
     """
     Отметить твит как понравившийся
 
@@ -136,16 +272,73 @@ async def tweet_like(id_tweet, api_key: str = Header(default=..., alias='api-key
     """
 
 
-    user = await get_user(api_key)
-    like_model = Like(tweet_id=int(id_tweet), user_id=user.id)
-    session.add(like_model)
-    await session.commit()
-    await session.refresh(like_model)
+    user = await get_user(session, api_key)
+    if like_buffer.enabled:
+        like_buffer.record(user.id, int(id_tweet), True)
+        invalidate_feeds(user_ids=[user.id])
+        publish_likes('tweet_liked', user, [int(id_tweet)])
+        return {'result': True}
+    if await add_like(session, user.id, int(id_tweet)):
+        authors = await tweet_authors(session, [int(id_tweet)])
+        await session.commit()
+        score_refresher.mark_tweets([int(id_tweet)])
+        invalidate_feeds(author_ids=authors)
+        publish_likes('tweet_liked', user, [int(id_tweet)])
     return {'result': True}
 
 
-@router.delete(path='/tweets/{id_tweet}/likes')
-async def tweet_unlike(id_tweet, api_key: str = Header(default=..., alias='api-key')):
+@router.post(path='/tweets/likes:batch', response_model=LikesBatchResultSchema, response_model_exclude_none=True)
+async def tweet_like_batch(
+    likes_data: LikesBatchSchema,
+    api_key: str = Header(default=..., alias='api-key'),
+    session: AsyncSession = Depends(get_session),
+):
+    """
+    Отметить несколько твитов как понравившиеся в одной транзакции
+
+    Parameters:
+        likes_data (LikesBatchSchema): идентификаторы твитов, не более BATCH_MAX_ITEMS
+        api_key (str): ключ API, используемый для идентификации пользователя
+
+    Returns:
+        dict: Результат для каждого твита: created=False, если лайк уже был
+
+    Raises:
+        HTTPException: Если пользователя нет в базе данных
+    """
+    user = await get_user(session, api_key)
+    if not user:
+        raise HTTPException(status_code=400, detail='Access denied')
+    tweet_ids = list(dict.fromkeys(likes_data.tweet_ids))
+    existing = await session.execute(
+        select(Tweet.id).where(Tweet.id == any_(int_array('tweet_ids', tweet_ids))),
+    )
+    existing_ids = set(existing.scalars())
+    async with like_buffer.bypass(user.id, tweet_ids):
+        liked = set(await add_likes(session, user.id, [tweet_id for tweet_id in tweet_ids if tweet_id in existing_ids]))
+        authors = await tweet_authors(session, liked)
+        await session.commit()
+    if liked:
+        score_refresher.mark_tweets(liked)
+        invalidate_feeds(author_ids=authors)
+        publish_likes('tweet_liked', user, liked)
+    return {
+        'result': True,
+        'results': [
+            {'tweet_id': tweet_id, 'result': True, 'created': tweet_id in liked}
+            if tweet_id in existing_ids
+            else {'tweet_id': tweet_id, 'result': False, 'detail': 'No tweet with this id'}
+            for tweet_id in tweet_ids
+        ],
+    }
+
+
+@router.delete(path='/tweets/{id_tweet}/likes', response_model=ResultSchema)
+async def tweet_unlike(
+    id_tweet,
+    api_key: str = Header(default=..., alias='api-key'),
+    session: AsyncSession = Depends(get_session),
+):
     """
     Убрать отметку Нравится
 
@@ -158,18 +351,27 @@ async def tweet_unlike(id_tweet, api_key: str = Header(default=..., alias='api-k
     """
 
 
-    user = await get_user(api_key)
-    await session.execute(
-        delete(Like).where(
-            Like.user_id == user.id, Like.tweet_id == int(id_tweet),
-        ),
-    )
-    await session.commit()
+    user = await get_user(session, api_key)
+    if like_buffer.enabled:
+        like_buffer.record(user.id, int(id_tweet), False)
+        invalidate_feeds(user_ids=[user.id])
+        publish_likes('tweet_unliked', user, [int(id_tweet)])
+        return {'result': True}
+    if await remove_like(session, user.id, int(id_tweet)):
+        authors = await tweet_authors(session, [int(id_tweet)])
+        await session.commit()
+        score_refresher.mark_tweets([int(id_tweet)])
+        invalidate_feeds(author_ids=authors)
+        publish_likes('tweet_unliked', user, [int(id_tweet)])
     return {'result': True}
 
 
-@router.post(path='/users/{id_user}/follow')
-async def tweet_follow(id_user, api_key: str = Header(default=..., alias='api-key')):
+@router.post(path='/users/{id_user}/follow', response_model=ResultSchema)
+async def tweet_follow(
+    id_user,
+    api_key: str = Header(default=..., alias='api-key'),
+    session: AsyncSession = Depends(get_session),
+):
     """
     Зафоловить другого пользователя
 
@@ -185,21 +387,75 @@ async def tweet_follow(id_user, api_key: str = Header(default=..., alias='api-ke
     """
 
 
-    user = await get_user(api_key)
+    user = await get_user(session, api_key)
     check = await session.execute(
         select(User).where(User.id == int(id_user)),
     )
     if check.scalar():
-        follow_model = Follow(follower_id=user.id, followed_id=int(id_user))
-        session.add(follow_model)
+        followed = await add_follow(session, user.id, int(id_user))
+        if followed:
+            await backfill_timeline(session, user.id, int(id_user))
         await session.commit()
-        await session.refresh(follow_model)
+        if followed:
+            score_refresher.mark_authors([int(id_user)])
+        invalidate_profiles(user.id, int(id_user))
+        invalidate_feeds(user_ids=[user.id], author_ids=[int(id_user)])
         return {'result': True}
     raise HTTPException(status_code=400, detail='User with this id doed not exist')
 
 
-@router.delete(path='/users/{id_user}/follow')
-async def tweet_unfollow(id_user, api_key: str = Header(default=..., alias='api-key')):
+@router.post(path='/users/follow:batch', response_model=FollowBatchResultSchema, response_model_exclude_none=True)
+async def tweet_follow_batch(
+    follow_data: FollowBatchSchema,
+    api_key: str = Header(default=..., alias='api-key'),
+    session: AsyncSession = Depends(get_session),
+):
+    """
+    Зафоловить несколько пользователей в одной транзакции
+
+    Parameters:
+        follow_data (FollowBatchSchema): идентификаторы пользователей, не более BATCH_MAX_ITEMS
+        api_key (str): ключ API, используемый для идентификации пользователя
+
+    Returns:
+        dict: Результат для каждого пользователя: created=False, если подписка уже была
+
+    Raises:
+        HTTPException: Если пользователя нет в базе данных
+    """
+    user = await get_user(session, api_key)
+    if not user:
+        raise HTTPException(status_code=400, detail='Access denied')
+    user_ids = list(dict.fromkeys(follow_data.user_ids))
+    existing = await session.execute(
+        select(User.id).where(User.id == any_(int_array('user_ids', user_ids))),
+    )
+    existing_ids = set(existing.scalars())
+    followed = await add_follows(session, user.id, [user_id for user_id in user_ids if user_id in existing_ids])
+    if followed:
+        await backfill_timelines(session, user.id, followed)
+    await session.commit()
+    if followed:
+        score_refresher.mark_authors(followed)
+        invalidate_profiles(user.id, *followed)
+        invalidate_feeds(user_ids=[user.id], author_ids=followed)
+    return {
+        'result': True,
+        'results': [
+            {'user_id': user_id, 'result': True, 'created': user_id in followed}
+            if user_id in existing_ids
+            else {'user_id': user_id, 'result': False, 'detail': 'User with this id doed not exist'}
+            for user_id in user_ids
+        ],
+    }
+
+
+@router.delete(path='/users/{id_user}/follow', response_model=ResultSchema)
+async def tweet_unfollow(
+    id_user,
+    api_key: str = Header(default=..., alias='api-key'),
+    session: AsyncSession = Depends(get_session),
+):
     """
     Отменить подписку на пользователя по идентификатору
 
@@ -212,58 +468,173 @@ async def tweet_unfollow(id_user, api_key: str = Header(default=..., alias='api-
     """
 
 
-    user = await get_user(api_key)
-    await session.execute(
-        delete(Follow).where(
-            Follow.follower_id == user.id, Follow.followed_id == int(id_user),
-        ),
-    )
+    user = await get_user(session, api_key)
+    unfollowed = await remove_follow(session, user.id, int(id_user))
+    if unfollowed:
+        await prune_timeline_author(session, user.id, int(id_user))
     await session.commit()
+    if unfollowed:
+        score_refresher.mark_authors([int(id_user)])
+    invalidate_profiles(user.id, int(id_user))
+    invalidate_feeds(user_ids=[user.id], author_ids=[int(id_user)])
     return {'result': True}
 
 
-@router.get(path='/tweets')
-async def tweet_get() -> dict:
+@router.get(path='/tweets', responses={200: {'model': FeedSchema}})
+async def tweet_get(
+    api_key: str = Header(default=..., alias='api-key'),
+    limit: int = Query(default=FEED_PAGE_SIZE, ge=1, le=FEED_MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+    size: Optional[str] = Query(default=None, pattern='^({0})$'.format('|'.join(MEDIA_VARIANTS))),
+    if_none_match: Optional[str] = Header(default=None, alias='if-none-match'),
+    session: AsyncSession = Depends(get_session),
+) -> StreamingResponse:
     """
-    Получить информацию о твитах
+    Получить ленту твитов пользователей, на которых подписан пользователь
+
+    Parameters:
+        api_key (str): ключ API, используемый для идентификации пользователя
+        limit (int): количество твитов на странице
+        cursor (str): курсор следующей страницы из предыдущего ответа
+        size (str): вариант изображений во вложениях: thumbnail, feed или full
+        if_none_match (str): ETag ранее полученного ответа
 
     Returns:
-        dict: Словарь, содержащий информацию о твитах.
+        StreamingResponse: Страница ленты и курсор следующей страницы
+            или ответ 304, если лента не изменилась.
+
+    Raises:
+        HTTPException:  Если пользователя нет в базе данных или курсор повреждён
     """
-    tweets = await get_tweets_sort()
-    data_tweets = {
-        'result': True,
-        'tweets': [
-        ],
-    }
-    tweets.sort(key=lambda x_1: x_1[1], reverse=True)
-    for tweets_users in tweets:
-        data_tweets['tweets'].extend(await get_tweets_info(tweets_users))
-    return data_tweets
+    user = await get_user(session, api_key)
+    if not user:
+        raise HTTPException(status_code=400, detail='No user with this api-key')
+    try:
+        position = decode_cursor(cursor, float) if cursor else None
+    except ValueError:
+        raise HTTPException(status_code=400, detail='Invalid cursor')
+    async with session_for_version(session, timeline_version(user.id)) as read_session:
+        versions = feed_versions(user.id, await feed_authors(read_session, user.id))
+    etag = make_multi_etag(versions, user.id, limit, cursor, size)
+    if etag_matches(if_none_match, etag):
+        return not_modified(etag, FEED_CACHE_CONTROL)
+    async with session_for_version(session, *versions) as read_session:
+        tweets, next_cursor = await get_feed(read_session, user.id, limit, position, size, viewer=user)
+    return StreamingResponse(
+        stream_feed(tweets, next_cursor),
+        media_type='application/json',
+        headers={'ETag': etag, 'Cache-Control': FEED_CACHE_CONTROL},
+    )
+
+
+@router.get(path='/tweets/search', responses={200: {'model': FeedSchema}})
+async def tweet_search(
+    q: str = Query(min_length=1, max_length=256),
+    api_key: str = Header(default=..., alias='api-key'),
+    limit: int = Query(default=FEED_PAGE_SIZE, ge=1, le=FEED_MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+    size: Optional[str] = Query(default=None, pattern='^({0})$'.format('|'.join(MEDIA_VARIANTS))),
+    session: AsyncSession = Depends(get_session),
+) -> StreamingResponse:
+    """
+    Полнотекстовый поиск по твитам
+
+    Parameters:
+        q (str): поисковый запрос: слова, "фраза", -исключение, OR
+        api_key (str): ключ API, используемый для идентификации пользователя
+        limit (int): количество твитов на странице
+        cursor (str): курсор следующей страницы из предыдущего ответа
+        size (str): вариант изображений во вложениях: thumbnail, feed или full
 
+    Returns:
+        StreamingResponse: Найденные твиты по убыванию релевантности и курсор следующей страницы
 
-@router.get(path='/users/{user_id}')
-async def get_profile_for_id(user_id):
+    Raises:
+        HTTPException:  Если пользователя нет в базе данных или курсор повреждён
+    """
+    user = await get_user(session, api_key)
+    if not user:
+        raise HTTPException(status_code=400, detail='No user with this api-key')
+    try:
+        position = decode_cursor(cursor, float) if cursor else None
+    except ValueError:
+        raise HTTPException(status_code=400, detail='Invalid cursor')
+    tweets, next_cursor = await search_tweets(session, q, limit, position, size, viewer=user)
+    return StreamingResponse(stream_feed(tweets, next_cursor), media_type='application/json')
+
+
+@router.get(path='/users/{user_id}', response_model=ProfileSchema)
+async def get_profile_for_id(
+    user_id,
+    response: Response,
+    limit: Optional[int] = Query(default=None, ge=1, le=PROFILE_MAX_PAGE_SIZE),
+    followers_after: Optional[int] = None,
+    following_after: Optional[int] = None,
+    if_none_match: Optional[str] = Header(default=None, alias='if-none-match'),
+    session: AsyncSession = Depends(get_session),
+):
     """
     Получите информацию о профиле пользователя по идентификатору пользователя.
 
     Parameters:
         user_id (int): идентификатор пользователя,
+        limit (int): размер страницы списков подписчиков и подписок
+        followers_after (int): идентификатор последнего подписчика предыдущей страницы
+        following_after (int): идентификатор последней подписки предыдущей страницы
+        if_none_match (str): ETag ранее полученного ответа
 
     Returns:
-        dict: Информация о пользователе.
+        dict: Информация о пользователе или ответ 304, если профиль не изменился.
 
     Raises:
         HTTPException: Если пользователя нет в базе данных
     """
-    user_select = await session.execute(
-        select(User).where(User.id == int(user_id)),
-    )
-    name = user_select.scalar()
-    if name:
-        user_model = await get_users_info(user_id, name.name)
+    etag = make_etag(profile_version(int(user_id)), limit, followers_after, following_after)
+    if etag_matches(if_none_match, etag):
+        if not await user_exists(session, int(user_id)):
+            raise HTTPException(status_code=404, detail='No user with this id')
+        return not_modified(etag, PROFILE_CACHE_CONTROL)
+    async with session_for_version(session, profile_version(int(user_id))) as read_session:
+        user_model = await get_users_info(read_session, int(user_id), limit, followers_after, following_after)
+    if user_model:
+        response.headers['ETag'] = etag
+        response.headers['Cache-Control'] = PROFILE_CACHE_CONTROL
         return {
             'result': True,
-            'user': user_model.model_dump(),
+            'user': user_model,
         }
     raise HTTPException(status_code=404, detail='No user with this id')
+
+
+@router.get(path='/events', response_class=StreamingResponse)
+async def events_stream(
+    api_key: Optional[str] = Header(default=None, alias='api-key'),
+    api_key_query: Optional[str] = Query(default=None, alias='api-key'),
+    session: AsyncSession = Depends(get_session),
+) -> StreamingResponse:
+    """
+    Подписка на изменения ленты в формате Server-Sent Events
+
+    Ключ API можно передать параметром запроса, так как EventSource
+    в браузере не умеет задавать заголовки.
+
+    Parameters:
+        api_key (str): ключ API в заголовке
+        api_key_query (str): ключ API в параметре api-key
+
+    Returns:
+        StreamingResponse: Поток событий tweet_created, tweet_deleted, tweet_liked, tweet_unliked
+
+    Raises:
+        HTTPException: Если пользователя нет в базе данных
+    """
+    user = await get_user(session, api_key or api_key_query or '')
+    if not user:
+        raise HTTPException(status_code=400, detail='No user with this api-key')
+    await session.close()
+    subscriber = event_broker.subscribe(user.id)
+    return StreamingResponse(
+        stream_events(subscriber),
+        media_type='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'},
+    )
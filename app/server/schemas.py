@@ -1,6 +1,9 @@
+import os
 from typing import List, Optional
 
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
+
+BATCH_MAX_ITEMS = int(os.getenv('BATCH_MAX_ITEMS', '100'))
 
 
 class UserSchema(BaseModel):
@@ -11,6 +14,8 @@ class UserSchema(BaseModel):
 class UserOutSchema(UserSchema):
     followers: List[UserSchema]
     following: List[UserSchema]
+    followers_count: int = 0
+    following_count: int = 0
 
     class Config:\
         from_attributes = True
@@ -19,3 +24,75 @@ class UserOutSchema(UserSchema):
 class TweetSchema(BaseModel):
     tweet_data: str
     tweet_media_ids: Optional[List[int]]
+
+
+class TweetsBatchSchema(BaseModel):
+    tweets: List[TweetSchema] = Field(min_length=1, max_length=BATCH_MAX_ITEMS)
+
+
+class LikesBatchSchema(BaseModel):
+    tweet_ids: List[int] = Field(min_length=1, max_length=BATCH_MAX_ITEMS)
+
+
+class FollowBatchSchema(BaseModel):
+    user_ids: List[int] = Field(min_length=1, max_length=BATCH_MAX_ITEMS)
+
+
+class ResultSchema(BaseModel):
+    result: bool = True
+
+
+class TweetCreatedSchema(ResultSchema):
+    tweet_id: int
+
+
+class MediaCreatedSchema(ResultSchema):
+    media_id: int
+
+
+class LikeSchema(BaseModel):
+    user_id: int
+    name: str
+
+
+class TweetOutSchema(BaseModel):
+    id: int
+    content: str
+    attachments: List[Optional[str]]
+    author: UserSchema
+    likes: List[LikeSchema]
+
+
+class FeedSchema(ResultSchema):
+    tweets: List[TweetOutSchema]
+    next_cursor: Optional[str] = None
+
+
+class ProfileSchema(ResultSchema):
+    user: UserOutSchema
+
+
+class BatchItemSchema(BaseModel):
+    result: bool
+    created: Optional[bool] = None
+    detail: Optional[str] = None
+
+
+class LikeBatchItemSchema(BatchItemSchema):
+    tweet_id: int
+
+
+class FollowBatchItemSchema(BatchItemSchema):
+    user_id: int
+
+
+class TweetsBatchResultSchema(ResultSchema):
+    results: List[TweetCreatedSchema]
+
+
+class LikesBatchResultSchema(ResultSchema):
+    results: List[LikeBatchItemSchema]
+
+
+class FollowBatchResultSchema(ResultSchema):
+    results: List[FollowBatchItemSchema]
@@ -0,0 +1,58 @@
+import asyncio
+import logging
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+from cache import invalidate_feeds
+from database import async_session
+from media import render_variants
+from models import Media
+from sqlalchemy import update
+
+logger = logging.getLogger(__name__)
+
+MEDIA_WORKERS = int(os.getenv('MEDIA_WORKERS', '2'))
+
+_executor = None
+
+
+def get_executor():
+    """Пул процессов для обработки изображений, создаётся при первом обращении"""
+    global _executor
+    if _executor is None:
+        _executor = ProcessPoolExecutor(
+            max_workers=MEDIA_WORKERS,
+            mp_context=multiprocessing.get_context('spawn'),
+        )
+    return _executor
+
+
+def shutdown_executor():
+    """Остановить пул процессов"""
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(cancel_futures=True)
+        _executor = None
+
+
+async def generate_variants(media_id, filelocation):
+    """
+    Построить варианты изображения вне обработки запроса и сохранить их в Media.
+
+    Декодирование и масштабирование выполняются в пуле процессов, чтобы
+    не блокировать цикл событий.
+    """
+    loop = asyncio.get_running_loop()
+    try:
+        variants = await loop.run_in_executor(get_executor(), render_variants, filelocation)
+    except Exception:
+        logger.exception('Не удалось построить варианты для медиа %s', media_id)
+        return
+    async with async_session() as session:
+        owner = await session.execute(
+            update(Media).where(Media.id == media_id).values(variants=variants).returning(Media.user_id),
+        )
+        author_ids = owner.scalars().all()
+        await session.commit()
+    invalidate_feeds(author_ids=author_ids)
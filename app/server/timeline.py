@@ -0,0 +1,162 @@
+import os
+
+from models import Follow, Timeline, Tweet, User
+from sqlalchemy import ARRAY, Integer, any_, bindparam, delete, func, literal, true, union_all
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.future import select
+
+FANOUT_FOLLOWERS_LIMIT = int(os.getenv('FANOUT_FOLLOWERS_LIMIT', '10000'))
+TIMELINE_BACKFILL_LIMIT = int(os.getenv('TIMELINE_BACKFILL_LIMIT', '1000'))
+
+
+async def get_followers_count(session, user_id):
+    """Количество подписчиков пользователя"""
+    followers_count = await session.execute(
+        select(User.followers_count).where(User.id == user_id),
+    )
+    return followers_count.scalar() or 0
+
+
+async def fan_out_tweets(session, author_id, tweet_ids):
+    """
+    Разослать твиты автора в ленты его подписчиков одним запросом.
+
+    Твиты всегда попадают в ленту самого автора. Твиты пользователей,
+    у которых подписчиков больше FANOUT_FOLLOWERS_LIMIT, в ленты подписчиков
+    не копируются и читаются при выдаче ленты напрямую из таблицы твитов.
+    """
+    new_tweets = select(Tweet.id, Tweet.score).where(
+        Tweet.id == any_(bindparam('tweet_ids', list(tweet_ids), type_=ARRAY(Integer))),
+    ).subquery()
+    recipients = select(literal(author_id), new_tweets.c.id, literal(author_id), new_tweets.c.score)
+    if await get_followers_count(session, author_id) <= FANOUT_FOLLOWERS_LIMIT:
+        recipients = union_all(
+            recipients,
+            select(Follow.follower_id, new_tweets.c.id, literal(author_id), new_tweets.c.score).join_from(
+                Follow, new_tweets, true(),
+            ).where(
+                Follow.followed_id == author_id,
+                Follow.follower_id != author_id,
+            ),
+        )
+    await session.execute(
+        insert(Timeline).from_select(
+            ['user_id', 'tweet_id', 'author_id', 'score'], recipients,
+        ).on_conflict_do_nothing(),
+    )
+
+
+async def fan_out_tweet(session, tweet):
+    """Разослать твит в ленты подписчиков автора"""
+    await fan_out_tweets(session, tweet.user_id, [tweet.id])
+
+
+async def backfill_timelines(session, follower_id, followed_ids):
+    """Добавить в ленту подписчика последние твиты новых авторов одним запросом"""
+    latest_tweets = select(
+        Tweet.id,
+        Tweet.user_id,
+        Tweet.score,
+        func.row_number().over(partition_by=Tweet.user_id, order_by=Tweet.id.desc()).label('position'),
+    ).join(
+        User, User.id == Tweet.user_id,
+    ).where(
+        Tweet.user_id == any_(bindparam('followed_ids', list(followed_ids), type_=ARRAY(Integer))),
+        User.followers_count <= FANOUT_FOLLOWERS_LIMIT,
+    ).subquery()
+    await session.execute(
+        insert(Timeline).from_select(
+            ['user_id', 'tweet_id', 'author_id', 'score'],
+            select(literal(follower_id), latest_tweets.c.id, latest_tweets.c.user_id, latest_tweets.c.score).where(
+                latest_tweets.c.position <= TIMELINE_BACKFILL_LIMIT,
+            ),
+        ).on_conflict_do_nothing(),
+    )
+
+
+async def backfill_timeline(session, follower_id, followed_id):
+    """Добавить в ленту подписчика последние твиты нового автора"""
+    await backfill_timelines(session, follower_id, [followed_id])
+
+
+async def rebuild_timelines(session):
+    """
+    Заполнить ленты всех пользователей последними твитами их подписок,
+    например после массовой загрузки данных в обход API.
+    """
+    latest_tweets = select(
+        Tweet.id,
+        Tweet.user_id,
+        Tweet.score,
+        func.row_number().over(partition_by=Tweet.user_id, order_by=Tweet.id.desc()).label('position'),
+    ).subquery()
+    recent = select(latest_tweets.c.id, latest_tweets.c.user_id, latest_tweets.c.score).where(
+        latest_tweets.c.position <= TIMELINE_BACKFILL_LIMIT,
+    ).subquery()
+    await session.execute(
+        insert(Timeline).from_select(
+            ['user_id', 'tweet_id', 'author_id', 'score'],
+            union_all(
+                select(recent.c.user_id, recent.c.id, recent.c.user_id, recent.c.score),
+                select(Follow.follower_id, recent.c.id, recent.c.user_id, recent.c.score).join(
+                    recent, recent.c.user_id == Follow.followed_id,
+                ).join(
+                    User, User.id == Follow.followed_id,
+                ).where(
+                    Follow.follower_id != Follow.followed_id,
+                    User.followers_count <= FANOUT_FOLLOWERS_LIMIT,
+                ),
+            ),
+        ).on_conflict_do_nothing(),
+    )
+
+
+async def backfill_author_followers(session, author_id):
+    """
+    Разослать последние твиты автора в ленты всех его подписчиков одним запросом.
+
+    Нужно, когда число подписчиков автора опустилось до FANOUT_FOLLOWERS_LIMIT:
+    его твиты, написанные выше порога, не были разосланы, а читать их
+    напрямую из таблицы твитов лента перестаёт.
+    """
+    latest_tweets = select(Tweet.id, Tweet.score).where(
+        Tweet.user_id == author_id,
+    ).order_by(Tweet.id.desc()).limit(TIMELINE_BACKFILL_LIMIT).subquery()
+    await session.execute(
+        insert(Timeline).from_select(
+            ['user_id', 'tweet_id', 'author_id', 'score'],
+            select(Follow.follower_id, latest_tweets.c.id, literal(author_id), latest_tweets.c.score).join_from(
+                Follow, latest_tweets, true(),
+            ).where(
+                Follow.followed_id == author_id,
+                Follow.follower_id != author_id,
+            ),
+        ).on_conflict_do_nothing(),
+    )
+
+
+async def prune_author_followers(session, author_ids):
+    """
+    Убрать твиты авторов из лент подписчиков одним запросом.
+
+    Нужно, когда число подписчиков автора превысило FANOUT_FOLLOWERS_LIMIT:
+    его твиты читаются напрямую из таблицы твитов, и копии в лентах
+    только дублировали бы их. В ленте самого автора твиты остаются.
+    """
+    await session.execute(
+        delete(Timeline).where(
+            Timeline.author_id == any_(bindparam('author_ids', list(author_ids), type_=ARRAY(Integer))),
+            Timeline.user_id != Timeline.author_id,
+        ),
+    )
+
+
+async def prune_timeline_author(session, follower_id, followed_id):
+    """Убрать из ленты подписчика твиты автора, от которого он отписался"""
+    if follower_id == followed_id:
+        return
+    await session.execute(
+        delete(Timeline).where(
+            Timeline.user_id == follower_id, Timeline.author_id == followed_id,
+        ),
+    )
@@ -1,115 +1,112 @@
-from database import session
-from routes import Follow, Like, Media, Tweet, User
+import os
+
+from cache import MISSING, CachedUser, auth_cache, auth_negative_cache, profile_cache
+from models import Follow, User
 from schemas import UserOutSchema
-from sqlalchemy import func
+from sqlalchemy import literal, union_all
 from sqlalchemy.future import select
 
+PROFILE_MAX_PAGE_SIZE = int(os.getenv('PROFILE_MAX_PAGE_SIZE', '1000'))
+
+
+def follow_list_query(kind, user_id, limit=None, after=None):
+    """
+    Подписчики (kind='followers') или подписки (kind='following') с именами.
+
+    Списки упорядочены по идентификатору пользователя; after задаёт
+    идентификатор последнего пользователя предыдущей страницы.
+    """
+    if kind == 'followers':
+        user_column, other_column = Follow.followed_id, Follow.follower_id
+    else:
+        user_column, other_column = Follow.follower_id, Follow.followed_id
+    query = select(literal(kind).label('kind'), User.id, User.name).join(
+        Follow, other_column == User.id,
+    ).where(user_column == user_id)
+    if after is not None:
+        query = query.where(User.id > after)
+    query = query.order_by(User.id)
+    if limit is not None:
+        query = query.limit(limit)
+    return query.subquery().select()
+
+
+async def user_exists(session, user_id):
+    """Есть ли пользователь; закэшированный профиль избавляет от запроса"""
+    if profile_cache.get(user_id) is not MISSING:
+        return True
+    found = await session.execute(select(User.id).where(User.id == user_id))
+    return found.first() is not None
+
+
+async def get_users_info(session, user_id, limit=None, followers_after=None, following_after=None):
+    """
+    Профиль пользователя за два запроса: сам пользователь и оба списка подписок.
+
+    Профиль без пагинации кэшируется на PROFILE_CACHE_TTL секунд.
+
+    Returns:
+        UserOutSchema | None: Профиль или None, если пользователя нет
+    """
+    paginated = limit is not None or followers_after is not None or following_after is not None
+    if not paginated:
+        cached_profile = profile_cache.get(user_id)
+        if cached_profile is not MISSING:
+            return cached_profile
 
-async def get_users_info(user_id, user_name):
-    followers_data = await session.execute(
-        select(Follow).where(Follow.followed_id == int(user_id)),
-    )
-    follow_list = [[], []]
-    for followers in followers_data.scalars():
-        name_user = await session.execute(
-            select(User).where(User.id == followers.follower_id),
-        )
-        follow_list[0].append({
-            'id': followers.follower_id,
-            'name': name_user.scalar().name,
-        })
-
-    followers_data = await session.execute(
-        select(Follow).where(Follow.follower_id == int(user_id)),
-    )
-    for followed in followers_data.scalars():
-        name_user = await session.execute(
-            select(User).where(User.id == followed.followed_id),
-        )
-        follow_list[1].append({
-            'id': followed.followed_id,
-            'name': name_user.scalar().name,
-        })
-
-    return UserOutSchema(
-        id=user_id,
-        name=user_name,
-        followers=follow_list[0],
-        following=follow_list[1],
-    )
-
-
-async def get_user(api_key):
     user_select = await session.execute(
-        select(User).where(User.api_key == api_key),
+        select(User.id, User.name, User.followers_count, User.following_count).where(User.id == user_id),
     )
-    return user_select.scalar()
-
-
-async def get_tweets(id_f):
-    follower_count = await session.execute(
-        select(func.count()).select_from(Follow).where(Follow.followed_id == id_f),
+    user = user_select.first()
+    if user is None:
+        return None
+
+    follow_lists = {'followers': [], 'following': []}
+    follow_data = await session.execute(
+        union_all(
+            follow_list_query('followers', user_id, limit, followers_after),
+            follow_list_query('following', user_id, limit, following_after),
+        ),
     )
-    follower_count = follower_count.scalar()
-    tweet_select = await session.execute(
-        select(Tweet).where(Tweet.user_id == id_f),
-    )
-
-    return tweet_select.scalars(), follower_count if isinstance(follower_count, int) else 0
-
-
-async def get_likes_for_tweet(tweet_id):
-    likes = []
-    like_d = await session.execute(
-        select(Like).where(Like.tweet_id == tweet_id),
-    )
-    for like in like_d.scalars():
-        name_user = await session.execute(
-            select(User).where(User.id == like.user_id),
-        )
-        likes.append({
-            'user_id': like.user_id,
-            'name': name_user.scalar().name,
+    for kind, follow_id, follow_name in follow_data:
+        follow_lists[kind].append({
+            'id': follow_id,
+            'name': follow_name,
         })
-    return likes
-
 
-async def get_attachments_for_tweet(tweet):
-    attachments = []
-    for file_id in tweet.attachments:
-        attachments_d = await session.execute(
-            select(Media.path_file).where(Media.id == int(file_id)),
+    profile = UserOutSchema(
+        id=user.id,
+        name=user.name,
+        followers=follow_lists['followers'],
+        following=follow_lists['following'],
+        followers_count=user.followers_count,
+        following_count=user.following_count,
+    )
+    if not paginated:
+        profile_cache.set(user_id, profile)
+    return profile
+
+
+async def get_user(session, api_key):
+    """
+    Пользователь по ключу API.
+
+    Результат, в том числе отсутствие пользователя, кэшируется в памяти
+    процесса, чтобы не обращаться к базе данных на каждом запросе.
+    Найденный пользователь запоминается в session.info['user'].
+    """
+    cached_user = auth_cache.get(api_key)
+    if cached_user is MISSING:
+        if auth_negative_cache.get(api_key) is not MISSING:
+            return None
+        user_select = await session.execute(
+            select(User.id, User.name, User.api_key).where(User.api_key == api_key),
         )
-        attachments.append(attachments_d.scalar())
-    return attachments
-
-
-async def get_tweets_info(tweets_users):
-    data_tweets = []
-    for elem in tweets_users[0]:
-        likes = await get_likes_for_tweet(elem.id)
-        attachments = await get_attachments_for_tweet(elem)
-
-        data_tweets.append({
-            'id': elem.id,
-            'content': elem.content_data,
-            'attachments': attachments,
-            'author': {
-                'id': elem.user_id,
-                'name': elem.user.name,
-            },
-            'likes': likes,
-        })
-
-    return data_tweets
-
-
-async def get_tweets_sort():
-
-    user = await session.execute(select(User))
-    users_ids = [user.id for user in user.scalars()]
-    tweets = []
-    for id_f in users_ids:
-        data_d = await get_tweets(id_f)
-        tweets.append(data_d)
-    return tweets
+        user = user_select.first()
+        if user is None:
+            auth_negative_cache.set(api_key, None)
+            return None
+        cached_user = CachedUser(*user)
+        auth_cache.set(api_key, cached_user)
+    session.info['user'] = cached_user
+    return cached_user
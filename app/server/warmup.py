@@ -0,0 +1,109 @@
+"""
+Прогрев приложения после запуска.
+
+Миграции выполняются отдельным одноразовым шагом (init_db.py), а при старте
+процесса открываются постоянные соединения пула и на каждом из них
+выполняются горячие запросы чтения: SQLAlchemy компилирует их в кэш движка,
+asyncpg подготавливает их в каждом соединении. Пока прогрев не закончен,
+GET /ready отвечает 503, после — 200 со временем прогрева и запуска.
+"""
+import asyncio
+import logging
+import os
+import time
+
+from cache import auth_negative_cache
+from database import POOL_OPTIONS, engine, env_flag, read_replica
+from feed import get_attachments_paths, get_feed, get_likes_for_tweets, search_tweets
+from sqlalchemy import union_all
+from sqlalchemy.ext.asyncio import AsyncSession
+from utlis import follow_list_query, get_user
+
+logger = logging.getLogger(__name__)
+
+WARMUP_ENABLED = env_flag('WARMUP_ENABLED', True)
+WARMUP_CONNECTIONS = int(os.getenv('WARMUP_CONNECTIONS', str(POOL_OPTIONS['pool_size'])))
+WARMUP_RETRY = float(os.getenv('WARMUP_RETRY', '1'))
+WARMUP_API_KEY = 'warmup-nonexistent-api-key'
+
+PROCESS_STARTED = time.monotonic()
+
+
+class Readiness:
+    """Готовность процесса принимать трафик"""
+
+    def __init__(self) -> None:
+        self.ready = False
+        self.warmup_seconds = None
+        self.startup_seconds = None
+
+    def mark_ready(self, warmup_seconds: float) -> None:
+        """Прогрев закончен"""
+        self.warmup_seconds = warmup_seconds
+        self.startup_seconds = time.monotonic() - PROCESS_STARTED
+        self.ready = True
+
+    def status(self) -> dict:
+        """Состояние для GET /ready"""
+        if not self.ready:
+            return {'ready': False}
+        return {
+            'ready': True,
+            'warmup_ms': round(self.warmup_seconds * 1000, 2),
+            'startup_ms': round(self.startup_seconds * 1000, 2),
+        }
+
+
+readiness = Readiness()
+
+
+async def warm_statements(session) -> None:
+    """Выполнить горячие запросы чтения с заведомо пустым результатом"""
+    await get_user(session, WARMUP_API_KEY)
+    auth_negative_cache.invalidate(WARMUP_API_KEY)
+    await get_feed(session, 0)
+    await get_feed(session, 0, cursor=(0, 0))
+    await get_likes_for_tweets(session, [0])
+    await get_attachments_paths(session, {0})
+    await search_tweets(session, 'warmup')
+    await session.execute(union_all(follow_list_query('followers', 0), follow_list_query('following', 0)))
+
+
+async def warm_engine(target_engine, connections: int) -> None:
+    """Открыть connections соединений пула одновременно и прогреть запросы на каждом"""
+    async def warm_connection() -> None:
+        async with target_engine.connect() as conn:
+            async with AsyncSession(bind=conn) as session:
+                await warm_statements(session)
+
+    await asyncio.gather(*(warm_connection() for _ in range(connections)))
+
+
+async def warm_up(connections: int = WARMUP_CONNECTIONS) -> float:
+    """
+    Прогреть основной движок и реплику для чтения, если она задана.
+
+    Returns:
+        float: Время прогрева в секундах
+    """
+    started = time.perf_counter()
+    await warm_engine(engine, connections)
+    if read_replica is not None:
+        await read_replica.check()
+        if read_replica.available():
+            await warm_engine(read_replica.engine, connections)
+    return time.perf_counter() - started
+
+
+async def run_warmup() -> None:
+    """Прогревать приложение, пока не получится, и отметить готовность"""
+    while True:
+        try:
+            warmup_seconds = await warm_up()
+        except Exception:
+            logger.exception('Прогрев не удался, повтор через %s с', WARMUP_RETRY)
+            await asyncio.sleep(WARMUP_RETRY)
+        else:
+            readiness.mark_ready(warmup_seconds)
+            logger.info('Прогрев занял %.0f мс', warmup_seconds * 1000)
+            return
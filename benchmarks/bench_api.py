@@ -0,0 +1,331 @@
+"""
+Нагрузочный тест всех маршрутов API: пропускная способность, задержки и число SQL-запросов.
+
+Перед запуском база данных заполняется скриптом benchmarks/seed.py; клиенты
+берутся из пользователей bench_<n>. Для каждого сценария и каждого уровня
+параллельности выполняется --requests запросов, выводятся req/s, p50/p95/p99
+и среднее число SQL-запросов на запрос (только при запуске в этом же процессе).
+Результаты сохраняются в JSON вместе с хешем коммита; с параметром --baseline
+выводится сравнение с сохранённым ранее прогоном.
+
+Пример:
+    python benchmarks/seed.py --users 2000 --reset
+    python benchmarks/bench_api.py --concurrency 1 8 32 --requests 400
+    python benchmarks/bench_api.py --base-url http://localhost:8000 --only feed profile
+"""
+import argparse
+import asyncio
+import io
+import json
+import os
+import random
+import statistics
+import subprocess
+import sys
+import time
+
+from httpx import ASGITransport, AsyncClient
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'app', 'server'))
+
+from database import async_session  # noqa: E402
+from models import Tweet, User  # noqa: E402
+from PIL import Image  # noqa: E402
+from seed import BENCH_PREFIX  # noqa: E402
+from sqlalchemy import Engine, event, func, select  # noqa: E402
+
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'results')
+
+
+class Context:
+    """Пользователи и твиты набора данных, общие для всех сценариев"""
+
+    def __init__(self, users: list, tweet_ids: list, dataset: dict, rng: random.Random) -> None:
+        self.users = users
+        self.tweet_ids = tweet_ids
+        self.dataset = dataset
+        self.created_tweets: list = []
+        self.rng = rng
+
+    def user(self):
+        """Случайный пользователь (id, api_key)"""
+        return self.rng.choice(self.users)
+
+    def tweet_id(self) -> int:
+        """Случайный существующий твит"""
+        return self.rng.choice(self.tweet_ids)
+
+
+def png_bytes(rng: random.Random) -> bytes:
+    """Небольшое изображение PNG со случайным цветом"""
+    buffer = io.BytesIO()
+    Image.new('RGB', (64, 64), tuple(rng.randrange(256) for _ in range(3))).save(buffer, 'PNG')
+    return buffer.getvalue()
+
+
+async def feed(client, ctx):
+    """Лента пользователя"""
+    return await client.get('/api/tweets', headers={'api-key': ctx.user()[1]})
+
+
+async def search(client, ctx):
+    """Полнотекстовый поиск по твитам"""
+    return await client.get('/api/tweets/search', params={'q': 'bench'}, headers={'api-key': ctx.user()[1]})
+
+
+async def me(client, ctx):
+    """Профиль текущего пользователя"""
+    return await client.get('/api/users/me', headers={'api-key': ctx.user()[1]})
+
+
+async def profile(client, ctx):
+    """Профиль пользователя по id"""
+    return await client.get('/api/users/{0}'.format(ctx.user()[0]))
+
+
+async def tweet_post(client, ctx):
+    """Новый твит; созданные твиты удаляет сценарий tweet_delete"""
+    _, api_key = ctx.user()
+    response = await client.post(
+        '/api/tweets', headers={'api-key': api_key}, json={'tweet_data': 'bench', 'tweet_media_ids': []},
+    )
+    if response.status_code == 200:
+        ctx.created_tweets.append((response.json()['tweet_id'], api_key))
+    return response
+
+
+async def tweets_batch(client, ctx):
+    """Десять твитов одним запросом"""
+    tweets = [{'tweet_data': 'bench batch', 'tweet_media_ids': []} for _ in range(10)]
+    return await client.post('/api/tweets:batch', headers={'api-key': ctx.user()[1]}, json={'tweets': tweets})
+
+
+async def tweet_delete(client, ctx):
+    """Удаление твита, созданного сценарием tweet_post"""
+    if not ctx.created_tweets:
+        return None
+    tweet_id, api_key = ctx.created_tweets.pop()
+    return await client.delete('/api/tweets/{0}'.format(tweet_id), headers={'api-key': api_key})
+
+
+async def media_upload(client, ctx):
+    """Загрузка изображения"""
+    files = {'file_media': ('bench.png', png_bytes(ctx.rng), 'image/png')}
+    return await client.post('/api/medias', headers={'api-key': ctx.user()[1]}, files=files)
+
+
+async def like(client, ctx):
+    """Лайк случайного твита"""
+    return await client.post('/api/tweets/{0}/likes'.format(ctx.tweet_id()), headers={'api-key': ctx.user()[1]})
+
+
+async def unlike(client, ctx):
+    """Отмена лайка случайного твита"""
+    return await client.delete('/api/tweets/{0}/likes'.format(ctx.tweet_id()), headers={'api-key': ctx.user()[1]})
+
+
+async def likes_batch(client, ctx):
+    """Десять лайков одним запросом"""
+    tweet_ids = [ctx.tweet_id() for _ in range(10)]
+    return await client.post('/api/tweets/likes:batch', headers={'api-key': ctx.user()[1]}, json={'tweet_ids': tweet_ids})
+
+
+async def follow(client, ctx):
+    """Подписка на случайного пользователя"""
+    return await client.post('/api/users/{0}/follow'.format(ctx.user()[0]), headers={'api-key': ctx.user()[1]})
+
+
+async def unfollow(client, ctx):
+    """Отписка от случайного пользователя"""
+    return await client.delete('/api/users/{0}/follow'.format(ctx.user()[0]), headers={'api-key': ctx.user()[1]})
+
+
+async def follow_batch(client, ctx):
+    """Десять подписок одним запросом"""
+    user_ids = [ctx.user()[0] for _ in range(10)]
+    return await client.post('/api/users/follow:batch', headers={'api-key': ctx.user()[1]}, json={'user_ids': user_ids})
+
+
+SCENARIOS = {
+    'feed': feed,
+    'search': search,
+    'me': me,
+    'profile': profile,
+    'tweet_post': tweet_post,
+    'tweets_batch': tweets_batch,
+    'tweet_delete': tweet_delete,
+    'media_upload': media_upload,
+    'like': like,
+    'unlike': unlike,
+    'likes_batch': likes_batch,
+    'follow': follow,
+    'unfollow': unfollow,
+    'follow_batch': follow_batch,
+}
+
+
+def percentile(values: list, share: float) -> float:
+    """Перцентиль по методу ближайшего ранга"""
+    ordered = sorted(values)
+    return ordered[min(int(share * len(ordered)), len(ordered) - 1)]
+
+
+class StatementCounter:
+    """Счётчик SQL-запросов, выполненных через SQLAlchemy в этом процессе"""
+
+    def __init__(self) -> None:
+        self.count = 0
+
+    def __call__(self, *args) -> None:
+        self.count += 1
+
+    def __enter__(self):
+        event.listen(Engine, 'before_cursor_execute', self)
+        return self
+
+    def __exit__(self, *exc) -> None:
+        event.remove(Engine, 'before_cursor_execute', self)
+
+
+async def run_scenario(client, ctx, scenario, concurrency: int, requests_count: int, in_process: bool) -> dict:
+    """Выполнить requests_count запросов сценария с заданной параллельностью"""
+    latencies = []
+    errors = 0
+    skipped = 0
+    remaining = iter(range(requests_count))
+
+    async def worker() -> None:
+        nonlocal errors, skipped
+        for _ in remaining:
+            started = time.perf_counter()
+            response = await scenario(client, ctx)
+            if response is None:
+                skipped += 1
+                continue
+            latencies.append(time.perf_counter() - started)
+            if response.status_code >= 400:
+                errors += 1
+
+    with StatementCounter() as statements:
+        started = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - started
+    if not latencies:
+        return {'requests': 0, 'skipped': skipped}
+    return {
+        'requests': len(latencies),
+        'errors': errors,
+        'skipped': skipped,
+        'rps': len(latencies) / elapsed,
+        'p50_ms': percentile(latencies, 0.5) * 1000,
+        'p95_ms': percentile(latencies, 0.95) * 1000,
+        'p99_ms': percentile(latencies, 0.99) * 1000,
+        'mean_ms': statistics.fmean(latencies) * 1000,
+        'queries_per_request': statements.count / len(latencies) if in_process else None,
+    }
+
+
+async def load_context(seed: int) -> Context:
+    """Пользователи bench_<n> и их твиты из базы данных"""
+    async with async_session() as session:
+        users = await session.execute(
+            select(User.id, User.api_key).where(User.name.like(BENCH_PREFIX + '%')).order_by(User.id),
+        )
+        users = [tuple(row) for row in users]
+        if not users:
+            raise SystemExit('Нет пользователей {0}*: сначала запустите benchmarks/seed.py'.format(BENCH_PREFIX))
+        tweets = await session.execute(
+            select(Tweet.id).join(User, User.id == Tweet.user_id).where(User.name.like(BENCH_PREFIX + '%')),
+        )
+        tweet_ids = tweets.scalars().all()
+        dataset = await session.execute(select(func.count()).select_from(Tweet))
+    return Context(users, tweet_ids, {'users': len(users), 'tweets': dataset.scalar()}, random.Random(seed))
+
+
+def git_commit() -> str:
+    """Хеш текущего коммита или None вне репозитория"""
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_comparison(results: list, baseline_path: str) -> None:
+    """Сравнить p95 и req/s с сохранённым прогоном"""
+    with open(baseline_path) as baseline_file:
+        baseline = {
+            (row['scenario'], row['concurrency']): row for row in json.load(baseline_file)['results']
+        }
+    print('\n{0:<14} {1:>5} {2:>10} {3:>10}'.format('vs baseline', 'conc', 'req/s', 'p95'))
+    for row in results:
+        before = baseline.get((row['scenario'], row['concurrency']))
+        if not before or not row.get('rps') or not before.get('rps'):
+            continue
+        print('{0:<14} {1:>5} {2:>+9.1f}% {3:>+9.1f}%'.format(
+            row['scenario'], row['concurrency'],
+            (row['rps'] / before['rps'] - 1) * 100, (row['p95_ms'] / before['p95_ms'] - 1) * 100,
+        ))
+
+
+async def main(args: argparse.Namespace) -> None:
+    """Прогнать все сценарии и сохранить результаты"""
+    ctx = await load_context(args.seed)
+    in_process = not args.base_url
+    if in_process:
+        from main import app
+
+        client = AsyncClient(transport=ASGITransport(app=app), base_url='http://bench', timeout=60)
+    else:
+        client = AsyncClient(base_url=args.base_url, timeout=60)
+
+    results = []
+    print('{0:<14} {1:>5} {2:>8} {3:>9} {4:>8} {5:>8} {6:>8} {7:>7} {8:>6}'.format(
+        'scenario', 'conc', 'requests', 'req/s', 'p50 ms', 'p95 ms', 'p99 ms', 'q/req', 'errors',
+    ))
+    async with client:
+        for name in args.only or SCENARIOS:
+            for concurrency in args.concurrency:
+                row = {'scenario': name, 'concurrency': concurrency}
+                row.update(await run_scenario(client, ctx, SCENARIOS[name], concurrency, args.requests, in_process))
+                results.append(row)
+                if not row['requests']:
+                    print('{0:<14} {1:>5} {2:>8}'.format(name, concurrency, 'skipped'))
+                    continue
+                queries = row['queries_per_request']
+                print('{0:<14} {1:>5} {2:>8} {3:>9.1f} {4:>8.1f} {5:>8.1f} {6:>8.1f} {7:>7} {8:>6}'.format(
+                    name, concurrency, row['requests'], row['rps'], row['p50_ms'], row['p95_ms'], row['p99_ms'],
+                    '-' if queries is None else '{0:.1f}'.format(queries), row['errors'],
+                ))
+
+    report = {
+        'commit': git_commit(),
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'mode': 'in-process' if in_process else args.base_url,
+        'dataset': ctx.dataset,
+        'requests': args.requests,
+        'results': results,
+    }
+    output = args.output or os.path.join(RESULTS_DIR, '{0}-{1}.json'.format(
+        report['commit'] or 'nogit', time.strftime('%Y%m%d-%H%M%S'),
+    ))
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w') as output_file:
+        json.dump(report, output_file, indent=2)
+    print('\nresults: {0}'.format(output))
+    if args.baseline:
+        print_comparison(results, args.baseline)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 8, 32])
+    parser.add_argument('--requests', type=int, default=200, help='запросов на сценарий и уровень параллельности')
+    parser.add_argument('--only', nargs='+', choices=sorted(SCENARIOS), help='запустить только эти сценарии')
+    parser.add_argument('--base-url', help='адрес запущенного сервера, например http://localhost:8000')
+    parser.add_argument('--output', help='файл для результатов, по умолчанию benchmarks/results/<commit>-<время>.json')
+    parser.add_argument('--baseline', help='JSON предыдущего прогона для сравнения')
+    parser.add_argument('--seed', type=int, default=1)
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,64 @@
+"""
+Нагрузочный тест: пропускная способность API в зависимости от числа параллельных клиентов.
+
+Каждый клиент последовательно выполняет запросы GET /api/tweets и GET /api/users/me.
+По умолчанию приложение запускается в этом же процессе через ASGITransport,
+с параметром --base-url запросы отправляются на запущенный сервер.
+
+Пример:
+    python benchmarks/bench_concurrency.py --clients 1 2 4 8 16 32 --requests 200
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+from httpx import ASGITransport, AsyncClient
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'app', 'server'))
+
+PATHS = ('/api/tweets', '/api/users/me')
+
+
+async def run_client(client: AsyncClient, api_key: str, requests_count: int) -> None:
+    """Последовательно выполнить запросы одного клиента"""
+    for index in range(requests_count):
+        response = await client.get(PATHS[index % len(PATHS)], headers={'api-key': api_key})
+        response.raise_for_status()
+
+
+async def measure(client: AsyncClient, api_key: str, clients: int, requests_count: int) -> float:
+    """Запросов в секунду при заданном числе параллельных клиентов"""
+    per_client = max(requests_count // clients, 1)
+    started = time.perf_counter()
+    await asyncio.gather(*(run_client(client, api_key, per_client) for _ in range(clients)))
+    return per_client * clients / (time.perf_counter() - started)
+
+
+async def main(args: argparse.Namespace) -> None:
+    """Прогнать нагрузку для каждого уровня параллельности"""
+    if args.base_url:
+        client = AsyncClient(base_url=args.base_url, timeout=60)
+    else:
+        from main import app
+
+        client = AsyncClient(transport=ASGITransport(app=app), base_url='http://bench', timeout=60)
+
+    async with client:
+        await measure(client, args.api_key, 1, len(PATHS))
+        baseline = None
+        print('{0:>8} {1:>10} {2:>8}'.format('clients', 'req/s', 'scale'))
+        for clients in args.clients:
+            throughput = await measure(client, args.api_key, clients, args.requests)
+            baseline = baseline or throughput
+            print('{0:>8} {1:>10.1f} {2:>7.2f}x'.format(clients, throughput, throughput / baseline))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--clients', type=int, nargs='+', default=[1, 2, 4, 8, 16, 32])
+    parser.add_argument('--requests', type=int, default=200, help='запросов на каждый уровень параллельности')
+    parser.add_argument('--api-key', default='test')
+    parser.add_argument('--base-url', help='адрес запущенного сервера, например http://localhost:8000')
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,108 @@
+"""
+Микробенчмарк сериализации страницы ленты.
+
+Сравнивает время превращения 1000 твитов (с вложениями и лайками) в тело
+ответа прежним путём — jsonable_encoder и json.dumps, по твиту на
+сообщение потока — и текущим: stream_feed на orjson, а также проверкой
+модели ответа FeedSchema с ORJSONResponse. База данных не нужна.
+
+Пример:
+    python benchmarks/bench_serialization.py --tweets 1000 --repeat 200
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'app', 'server'))
+
+from fastapi.encoders import jsonable_encoder  # noqa: E402
+from fastapi.responses import JSONResponse, ORJSONResponse  # noqa: E402
+from feed import stream_feed  # noqa: E402
+from schemas import FeedSchema  # noqa: E402
+
+
+def make_tweets(count: int, likes: int) -> list:
+    """Твиты в формате get_tweets_info"""
+    return [
+        {
+            'id': index,
+            'content': 'bench tweet number {0} with some text'.format(index),
+            'attachments': ['images/bench/{0}.png'.format(index)] if index % 10 == 0 else [],
+            'author': {'id': index % 97, 'name': 'bench_{0}'.format(index % 97)},
+            'likes': [{'user_id': user_id, 'name': 'bench_{0}'.format(user_id)} for user_id in range(likes)],
+        }
+        for index in range(count)
+    ]
+
+
+async def legacy_stream(tweets, next_cursor):
+    """Прежняя потоковая отдача: json.dumps и отдельное сообщение на каждый твит"""
+    yield '{"result": true, "tweets": ['
+    for index, tweet in enumerate(tweets):
+        yield (', ' if index else '') + json.dumps(tweet)
+    yield '], "next_cursor": {0}}}'.format(json.dumps(next_cursor))
+
+
+async def collect(stream) -> int:
+    """Прочитать поток целиком, как это делает сервер, и вернуть размер тела"""
+    size = 0
+    async for chunk in stream:
+        size += len(chunk.encode() if isinstance(chunk, str) else chunk)
+    return size
+
+
+async def legacy_stream_body(tweets):
+    """Прежняя потоковая отдача ленты"""
+    return await collect(legacy_stream(tweets, 'cursor'))
+
+
+async def orjson_stream_body(tweets):
+    """Текущая потоковая отдача ленты"""
+    return await collect(stream_feed(tweets, 'cursor'))
+
+
+async def jsonable_body(tweets):
+    """Ответ-словарь без модели ответа: путь FastAPI по умолчанию"""
+    return len(JSONResponse(jsonable_encoder({'result': True, 'tweets': tweets, 'next_cursor': 'cursor'})).body)
+
+
+async def response_model_body(tweets):
+    """Ответ через модель FeedSchema и ORJSONResponse"""
+    feed = FeedSchema.model_validate({'result': True, 'tweets': tweets, 'next_cursor': 'cursor'})
+    return len(ORJSONResponse(feed.model_dump(mode='json')).body)
+
+
+CASES = (
+    ('jsonable_encoder + json', jsonable_body),
+    ('stream json.dumps per tweet', legacy_stream_body),
+    ('FeedSchema + orjson', response_model_body),
+    ('stream orjson chunks', orjson_stream_body),
+)
+
+
+async def main(args: argparse.Namespace) -> None:
+    """Замерить каждый способ и вывести медиану и ускорение относительно первого"""
+    tweets = make_tweets(args.tweets, args.likes)
+    baseline = None
+    print('{0:<30} {1:>10} {2:>10} {3:>8}'.format('case', 'median ms', 'bytes', 'speedup'))
+    for name, case in CASES:
+        timings = []
+        for _ in range(args.repeat):
+            started = time.perf_counter()
+            size = await case(tweets)
+            timings.append(time.perf_counter() - started)
+        median = statistics.median(timings) * 1000
+        baseline = baseline or median
+        print('{0:<30} {1:>10.2f} {2:>10} {3:>7.1f}x'.format(name, median, size, baseline / median))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--tweets', type=int, default=1000)
+    parser.add_argument('--likes', type=int, default=5, help='лайков на твит')
+    parser.add_argument('--repeat', type=int, default=100)
+    asyncio.run(main(parser.parse_args()))
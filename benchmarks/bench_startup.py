@@ -0,0 +1,96 @@
+"""
+Время от запуска процесса сервера до первого быстрого ответа.
+
+Сервер запускается отдельным процессом uvicorn с прогревом (WARMUP_ENABLED=true)
+и без него. Для каждого запуска измеряется время до ответа 200 на GET /ready,
+задержка первого запроса к API и время от запуска до первого ответа, не
+медленнее устойчивой задержки более чем в --slack раз. Миграции должны быть
+применены заранее (python app/server/init_db.py).
+
+Пример:
+    python benchmarks/bench_startup.py --api-key bench_1 --runs 3
+"""
+import argparse
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import time
+
+import httpx
+
+SERVER_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'app', 'server')
+PATHS = ('/api/tweets', '/api/users/me')
+
+
+def free_port() -> int:
+    """Свободный TCP-порт"""
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def wait_ready(client: httpx.Client, timeout: float) -> None:
+    """Дождаться ответа 200 на GET /ready"""
+    deadline = time.perf_counter() + timeout
+    while time.perf_counter() < deadline:
+        try:
+            if client.get('/ready').status_code == 200:
+                return
+        except httpx.TransportError:
+            pass
+        time.sleep(0.01)
+    raise TimeoutError('Сервер не стал готов за {0} с'.format(timeout))
+
+
+def measure_start(warmup: bool, args: argparse.Namespace) -> dict:
+    """Один запуск сервера: время готовности и задержки первых запросов"""
+    port = free_port()
+    env = {**os.environ, 'WARMUP_ENABLED': 'true' if warmup else 'false'}
+    started = time.perf_counter()
+    server = subprocess.Popen(
+        [sys.executable, '-m', 'uvicorn', 'main:app', '--port', str(port), '--log-level', 'warning'],
+        cwd=SERVER_DIR, env=env,
+    )
+    try:
+        with httpx.Client(base_url='http://127.0.0.1:{0}'.format(port), headers={'api-key': args.api_key}) as client:
+            wait_ready(client, args.timeout)
+            ready = time.perf_counter() - started
+            latencies, finished = [], []
+            for index in range(args.requests):
+                request_started = time.perf_counter()
+                client.get(PATHS[index % len(PATHS)]).raise_for_status()
+                finished.append(time.perf_counter() - started)
+                latencies.append(finished[-1] - (request_started - started))
+    finally:
+        server.terminate()
+        server.wait(10)
+    steady = statistics.median(latencies[len(latencies) // 2:])
+    first_fast = next(at for at, latency in zip(finished, latencies) if latency <= steady * args.slack)
+    return {
+        'ready_ms': ready * 1000,
+        'first_ms': latencies[0] * 1000,
+        'first_fast_ms': first_fast * 1000,
+        'steady_ms': steady * 1000,
+    }
+
+
+def main(args: argparse.Namespace) -> None:
+    """Сравнить запуск с прогревом и без него"""
+    columns = ('ready_ms', 'first_ms', 'first_fast_ms', 'steady_ms')
+    print('{0:<10} {1:>10} {2:>10} {3:>14} {4:>10}'.format('mode', *columns))
+    for warmup in (False, True):
+        runs = [measure_start(warmup, args) for _ in range(args.runs)]
+        row = [statistics.median(run[column] for run in runs) for column in columns]
+        print('{0:<10} {1:>10.1f} {2:>10.1f} {3:>14.1f} {4:>10.1f}'.format('warm' if warmup else 'cold', *row))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--api-key', default='test')
+    parser.add_argument('--runs', type=int, default=3)
+    parser.add_argument('--requests', type=int, default=40, help='запросов после готовности в каждом запуске')
+    parser.add_argument('--slack', type=float, default=1.5, help='допустимое превышение устойчивой задержки')
+    parser.add_argument('--timeout', type=float, default=60)
+    main(parser.parse_args())
@@ -0,0 +1,174 @@
+"""
+Синтетический набор данных для нагрузочных тестов.
+
+Создаёт пользователей bench_<n> (api-key совпадает с именем), граф подписок
+со степенным распределением числа подписчиков, твиты, лайки и записи медиа,
+затем пересчитывает счётчики и заполняет ленты. Повторный запуск с --reset
+удаляет ранее созданных пользователей вместе с их данными.
+
+Пример:
+    python benchmarks/seed.py --users 2000 --tweets 20 --likes 5 --reset
+"""
+import argparse
+import asyncio
+import itertools
+import os
+import random
+import sys
+import time
+from datetime import datetime, timedelta, timezone
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'app', 'server'))
+
+from counters import int_array, repair_counters  # noqa: E402
+from database import async_session  # noqa: E402
+from migrations import migrate  # noqa: E402
+from models import Follow, Like, Media, Timeline, Tweet, User  # noqa: E402
+from sqlalchemy import any_, delete, func, insert, select, text  # noqa: E402
+
+BENCH_PREFIX = 'bench_'
+CHUNK_SIZE = 5000
+# Твиты создаются в течение последних 30 дней, чтобы затухание популярности влияло на ленту
+SPREAD_SECONDS = 30 * 86400
+
+
+def power_law_weights(count: int, exponent: float) -> list:
+    """Накопленные веса популярности: вес пользователя с рангом r пропорционален r^-exponent"""
+    return list(itertools.accumulate((rank + 1) ** -exponent for rank in range(count)))
+
+
+def follow_graph(user_ids: list, avg_following: int, exponent: float, rng: random.Random) -> list:
+    """
+    Пары (подписчик, автор): число подписок каждого пользователя распределено
+    экспоненциально, выбор автора — пропорционально степенным весам, поэтому
+    немногие пользователи собирают большую часть подписчиков.
+    """
+    weights = power_law_weights(len(user_ids), exponent)
+    popular = user_ids[:]
+    rng.shuffle(popular)
+    pairs = set()
+    for follower_id in user_ids:
+        following = min(int(rng.expovariate(1 / avg_following)) if avg_following else 0, len(user_ids) - 1)
+        for followed_id in rng.choices(popular, cum_weights=weights, k=following):
+            if followed_id != follower_id:
+                pairs.add((follower_id, followed_id))
+    return sorted(pairs)
+
+
+async def insert_chunks(session, model, rows: list) -> None:
+    """Вставить строки пачками по CHUNK_SIZE"""
+    for start in range(0, len(rows), CHUNK_SIZE):
+        await session.execute(insert(model), rows[start:start + CHUNK_SIZE])
+
+
+async def reset(session) -> None:
+    """Удалить пользователей, созданных предыдущими запусками"""
+    await session.execute(delete(User).where(User.name.like(BENCH_PREFIX + '%')))
+
+
+async def seed(args: argparse.Namespace) -> dict:
+    """
+    Заполнить базу данных синтетическими данными.
+
+    Returns:
+        dict: Количество созданных строк по таблицам
+    """
+    rng = random.Random(args.seed)
+    await migrate()
+    async with async_session() as session:
+        if args.reset:
+            await reset(session)
+        first = await session.execute(select(User.id).order_by(User.id.desc()).limit(1))
+        offset = (first.scalar() or 0) + 1
+        users = [
+            {'name': '{0}{1}'.format(BENCH_PREFIX, offset + index), 'api_key': '{0}{1}'.format(BENCH_PREFIX, offset + index)}
+            for index in range(args.users)
+        ]
+        inserted = await session.execute(insert(User).returning(User.id, sort_by_parameter_order=True), users)
+        user_ids = inserted.scalars().all()
+
+        media_rows = [
+            {'path_file': 'images/bench/{0}.png'.format(index), 'user_id': rng.choice(user_ids)}
+            for index in range(int(args.users * args.tweets * args.media_ratio))
+        ]
+        media_ids = []
+        if media_rows:
+            inserted = await session.execute(insert(Media).returning(Media.id, sort_by_parameter_order=True), media_rows)
+            media_ids = inserted.scalars().all()
+
+        tweets = []
+        now = datetime.now(timezone.utc)
+        for user_id in user_ids:
+            for _ in range(int(rng.expovariate(1 / args.tweets)) if args.tweets else 0):
+                attachments = [rng.choice(media_ids)] if media_ids and rng.random() < args.media_ratio else []
+                tweets.append({
+                    'user_id': user_id,
+                    'content_data': 'bench tweet',
+                    'attachments': attachments,
+                    'created_at': now - timedelta(seconds=rng.uniform(0, SPREAD_SECONDS)),
+                })
+        tweet_ids = []
+        for start in range(0, len(tweets), CHUNK_SIZE):
+            inserted = await session.execute(
+                insert(Tweet).returning(Tweet.id, sort_by_parameter_order=True), tweets[start:start + CHUNK_SIZE],
+            )
+            tweet_ids += inserted.scalars().all()
+
+        follows = follow_graph(user_ids, args.following, args.exponent, rng)
+        await insert_chunks(session, Follow, [
+            {'follower_id': follower_id, 'followed_id': followed_id} for follower_id, followed_id in follows
+        ])
+
+        likes = set()
+        for tweet_id in tweet_ids:
+            for user_id in rng.sample(user_ids, min(int(rng.expovariate(1 / args.likes)) if args.likes else 0, len(user_ids))):
+                likes.add((user_id, tweet_id))
+        await insert_chunks(session, Like, [{'user_id': user_id, 'tweet_id': tweet_id} for user_id, tweet_id in likes])
+
+        await repair_counters(session)
+        await session.execute(text(
+            'INSERT INTO timelines (user_id, tweet_id, author_id, score) '
+            'SELECT tweets.user_id, tweets.id, tweets.user_id, tweets.score FROM tweets WHERE tweets.id = ANY(:tweet_ids) '
+            'UNION ALL SELECT followers.follower_id, tweets.id, tweets.user_id, tweets.score FROM followers '
+            'JOIN tweets ON tweets.user_id = followers.followed_id WHERE tweets.id = ANY(:tweet_ids) '
+            'ON CONFLICT DO NOTHING',
+        ), {'tweet_ids': tweet_ids})
+        timelines = await session.execute(
+            select(func.count()).select_from(Timeline).where(Timeline.user_id == any_(int_array('user_ids', user_ids))),
+        )
+        await session.execute(text('ANALYZE'))
+        await session.commit()
+    return {
+        'users': len(user_ids),
+        'follows': len(follows),
+        'tweets': len(tweet_ids),
+        'likes': len(likes),
+        'medias': len(media_ids),
+        'timelines': timelines.scalar(),
+    }
+
+
+async def main(args: argparse.Namespace) -> None:
+    """Заполнение базы данных и вывод итогов"""
+    started = time.perf_counter()
+    counts = await seed(args)
+    print(', '.join('{0}={1}'.format(table, count) for table, count in counts.items()))
+    print('seeded in {0:.1f}s'.format(time.perf_counter() - started))
+
+
+def build_parser() -> argparse.ArgumentParser:
+    """Параметры набора данных"""
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--following', type=int, default=20, help='среднее число подписок пользователя')
+    parser.add_argument('--exponent', type=float, default=1.1, help='показатель степенного распределения популярности')
+    parser.add_argument('--tweets', type=int, default=20, help='среднее число твитов пользователя')
+    parser.add_argument('--likes', type=int, default=5, help='среднее число лайков твита')
+    parser.add_argument('--media-ratio', type=float, default=0.1, help='доля твитов с вложением')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--reset', action='store_true', help='удалить данные предыдущих запусков')
+    return parser
+
+
+if __name__ == '__main__':
+    asyncio.run(main(build_parser().parse_args()))
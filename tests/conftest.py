@@ -11,6 +11,7 @@ from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_asyn
 load_dotenv()
 
 if os.getenv("ENV") == "test":
+    from python_advanced_diploma.app.server.database import get_session, track_queries
     from python_advanced_diploma.app.server.main import app as _app
     from python_advanced_diploma.app.server.models import Base, User
 
@@ -19,6 +20,7 @@ if os.getenv("ENV") == "test":
         raise ValueError("URL для тестовой базы данных не установлен")
 
     engine = create_async_engine(url_engine, poolclass=NullPool)
+    track_queries(engine)
     async_session = async_sessionmaker(
         expire_on_commit=False,
         bind=engine,
@@ -34,6 +36,8 @@ if os.getenv("ENV") == "test":
         async with async_session() as s:
             yield s
 
+    _app.dependency_overrides[get_session] = override_get_session
+
 
     @pytest.fixture(scope="session", autouse=True)
     async def setup_test_db() -> AsyncGenerator[None, None]: